@@ -21,25 +21,59 @@ Version: 1.0.0
 Date: 16 juillet 2025
 """
 
+import copy
+import importlib.util
+import json
 import logging
+import re
 import sys
 import os
-from typing import Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator
 from contextlib import asynccontextmanager
-from functools import lru_cache
+from functools import lru_cache, partial
 from pathlib import Path
 from uuid import uuid4
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from transformers import pipeline, logging as hf_logging  # type: ignore
+import torch
+from transformers import (  # type: ignore
+    AsyncTextIteratorStreamer,
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    pipeline,
+    logging as hf_logging,
+)
 
 from dotenv import load_dotenv
-import requests
+import aiofiles
+import httpx
 import asyncio
 
+try:
+    import orjson  # dépendance optionnelle : (dé)sérialisation JSON plus rapide
+    
+    _json_loads = orjson.loads
+    
+    def _json_dumps(data: Any) -> str:
+        return orjson.dumps(data).decode()
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(data: Any) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
 # ───── Imports des modules locaux ────────────────────────────────────
 # Ajout du chemin src pour accéder aux modules de l'architecture
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../src'))
@@ -52,8 +86,9 @@ logging.basicConfig(
 logger = logging.getLogger("tw3.chat")
 
 try:
-    from config import config
-    from resilience import news_api_circuit_breaker, retry_with_backoff
+    from config import get_config
+    config = get_config()
+    from resilience import news_api_circuit_breaker, news_api_rate_limiter, retry_with_backoff
     from cache import cache_manager
     from monitoring import HealthCheckManager
     logger.info("Modules d'architecture chargés avec succès")
@@ -62,6 +97,7 @@ except ImportError as e:
     # Fallback gracieux si les modules ne sont pas disponibles
     config = None
     news_api_circuit_breaker = None
+    news_api_rate_limiter = None
     retry_with_backoff = None
     cache_manager = None
 
@@ -76,9 +112,11 @@ class AskIn(BaseModel):
     Attributes:
         question: La question de l'utilisateur (min 3 caractères)
         conv_id: ID de conversation optionnel pour la continuité
+        max_tokens: Budget de tokens générés (défaut serveur si absent, 2048 au plus)
     """
     question: str = Field(..., min_length=3, description="Question de l'utilisateur")
     conv_id: str | None = Field(None, description="ID de conversation (auto-généré si absent)")
+    max_tokens: int | None = Field(None, ge=1, le=2048, description="Nombre maximum de tokens générés")
 
 class AskOut(BaseModel):
     """
@@ -97,6 +135,106 @@ load_dotenv()
 API_KEY = os.getenv("NEWSAPI_KEY")
 if not API_KEY:
     raise ValueError("NEWSAPI_KEY environment variable is required")
+NEWSAPI_URL = "https://newsapi.org/v2/everything"
+NEWSAPI_TIMEOUT = float(os.getenv("NEWSAPI_TIMEOUT", "5"))
+# Délai total accordé à la recherche d'actualités (retries compris) avant de
+# répondre sans actualités : une API lente ne retarde pas la génération
+NEWS_DEADLINE = float(os.getenv("NEWS_DEADLINE", "6"))
+# Sonde de fraîcheur du cache d'actualités (secondes, 0 = désactivée)
+NEWS_INVALIDATION_INTERVAL = float(os.getenv("NEWS_INVALIDATION_INTERVAL", "300"))
+NEWS_INVALIDATION_MAX_QUERIES = 5
+
+# Écriture groupée des logs de conversation : un tampon par conversation, écrit
+# d'un seul appel quand il atteint LOG_BUFFER_SIZE octets ou toutes les
+# LOG_FLUSH_INTERVAL secondes, fichiers gardés ouverts (LRU)
+LOG_FLUSH_INTERVAL = 0.5
+LOG_BUFFER_SIZE = 4096
+LOG_MAX_OPEN_FILES = 128
+MODEL_NAME = "Qwen/Qwen2.5-Coder-7B-Instruct"
+
+# Quantification des poids : nf4 (4 bits, défaut), int8 ou bf16 (aucune)
+QUANT_MODE = os.getenv("TW3_QUANT", "nf4").lower()
+if QUANT_MODE not in ("nf4", "int8", "bf16"):
+    raise ValueError(f"TW3_QUANT invalide: {QUANT_MODE} (attendu: nf4, int8 ou bf16)")
+
+# Backend de génération : transformers (modèle local), vllm (moteur vLLM
+# dans le processus) ou remote (serveur vLLM externe)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "transformers").lower()
+if LLM_BACKEND not in ("transformers", "vllm", "remote"):
+    raise ValueError(f"LLM_BACKEND invalide: {LLM_BACKEND} (attendu: transformers, vllm ou remote)")
+# Quantification du moteur vLLM in-process : none (BF16), awq (INT4) ou fp8 (H100)
+VLLM_QUANT = os.getenv("VLLM_QUANT", "none").lower()
+if VLLM_QUANT not in ("none", "awq", "fp8"):
+    raise ValueError(f"VLLM_QUANT invalide: {VLLM_QUANT} (attendu: none, awq ou fp8)")
+REMOTE_LLM_URL = os.getenv("REMOTE_LLM_URL", "http://vllm:8000/v1").rstrip("/")
+REMOTE_LLM_TIMEOUT = float(os.getenv("REMOTE_LLM_TIMEOUT", "120"))
+# Connexions simultanées vers vLLM (aligné sur --max-num-seqs du serveur)
+REMOTE_LLM_MAX_CONNECTIONS = int(os.getenv("REMOTE_LLM_MAX_CONNECTIONS", "256"))
+
+# Génération Transformers locale sérialisée sur un seul thread : les requêtes
+# font la queue au lieu de se disputer le GPU
+GEN_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qwen-gen")
+# Requêtes regroupées au plus par appel `generate` du modèle Transformers local
+GEN_MAX_BATCH = int(os.getenv("GEN_MAX_BATCH", "8"))
+# File consommée par `_generation_loop` ; None tant que la boucle n'est pas démarrée
+_gen_queue: asyncio.Queue | None = None
+
+# Budget de génération par défaut : suffisant pour une réponse de chat
+DEFAULT_MAX_NEW_TOKENS = 512
+# Pénalité légère contre les boucles de fin de réponse
+REPETITION_PENALTY = 1.05
+# Le modèle qui enchaîne sur une nouvelle « Question : » a fini de répondre
+STOP_SEQUENCES = ("\nQuestion :", "\n\nQuestion")
+
+# Compilation du décodeur en CUDA graphs (coût payé au démarrage, désactivée par défaut)
+TORCH_COMPILE = os.getenv("TW3_COMPILE", "false").lower() == "true"
+# Décodage spéculatif : petit modèle brouillon de la même famille (même tokenizer),
+# vide pour désactiver. Incompatible avec le cache statique de TW3_COMPILE.
+DRAFT_MODEL_NAME = os.getenv("TW3_DRAFT_MODEL", "")
+if DRAFT_MODEL_NAME and TORCH_COMPILE:
+    raise ValueError("TW3_DRAFT_MODEL et TW3_COMPILE=true ne peuvent pas être combinés")
+# Tokens proposés par le brouillon à chaque vérification du modèle principal
+NUM_ASSISTANT_TOKENS = 5
+# Paliers de max_new_tokens : limitent le nombre de graphes compilés distincts
+MAX_NEW_TOKENS_BUCKETS = (512, 1024, 4096)
+
+# Blocs d'instructions statiques en tête des prompts (pré-tokenisés au démarrage).
+# Ils doivent rester en tête et se terminer par une ligne vide : le préfixe commun
+# est alors identique token pour token d'une requête à l'autre, et réutilisé par
+# le cache de préfixes de vLLM (seuls question et actualités sont recalculées).
+INSTRUCTIONS_WITH_NEWS = (
+    "Réponds à la question suivante uniquement en faisant un résumé des informations fournies et complètes la réponse avec tes connaissances internes si nécessaire."
+    "Précise toujours les sources des informations utilisées. Tu dois restituer la source de chaque information que tu utilises dans ta réponse avec sa date de publication.\n\n"
+    "Ne commence jamais par une excuse de type ‘en tant qu’IA, je n’ai pas accès au web’.\n\n"
+)
+INSTRUCTIONS_NO_NEWS = (
+    "Tu vas répondre à une question en utilisant uniquement tes connaissances internes.\n\n"
+    "INSTRUCTIONS :\n"
+    "- Réponds de manière factuelle et précise.\n"
+    "- N'invente jamais de sources, de liens, de dates ou de citations.\n"
+    "- Indique clairement que tu t'appuies sur tes connaissances générales, sans accès à l'actualité.\n"
+    "- Si la question porte sur des actualités récentes ou des développements très récents, indique que tu ne peux pas fournir de sources d'actualité ou d'exemples récents précis.\n"
+    "- Si la question porte sur des actualités récentes, termine ta réponse comme ceci :\n"
+    "'Pour obtenir des informations actualisées, veuillez poser votre question sous forme de mots-clés simples comme \"IA générative\", \"technologie\", \"cinéma\".'\n\n"
+    "- **IMPORTANT : Termine toujours ta réponse en conseillant à l'utilisateur de reformuler sa question en français avec des mots-clés simples comme 'IA générative', 'technologie', 'cinéma' pour obtenir des informations d'actualité précises.**\n\n"
+)
+
+# Parties invariantes des prompts, précalculées : chaque requête n'assemble plus
+# que `"".join` des constantes et des parties variables (question, actualités)
+_PROMPT_WITH_NEWS = (
+    INSTRUCTIONS_WITH_NEWS + "Question : ",
+    "\n\nArticles d’actualité à exploiter :\n",
+    "\nRéponse :",
+)
+_PROMPT_NO_NEWS = (
+    INSTRUCTIONS_NO_NEWS + "Question : ",
+    "\n\nRéponse :",
+)
+
+GENERATION_ERROR_ANSWER = (
+    "Désolé, une erreur technique est survenue lors de la génération de la réponse. "
+    "Merci de réessayer dans quelques instants."
+)
 
 # Création du dossier de logs de conversation
 LOG_DIR = Path("/app/volume/conversations")
@@ -107,49 +245,217 @@ logger.info(f"Répertoire de logs créé: {LOG_DIR}")
 health_manager = None
 if config:
     try:
-        health_manager = HealthCheckManager(API_KEY, lambda: get_pipe())
+        health_manager = HealthCheckManager(
+            API_KEY,
+            lambda: _vllm_health_probe if LLM_BACKEND == "vllm" else _local_health_probe,
+            model_base_url=REMOTE_LLM_URL if LLM_BACKEND == "remote" else None
+        )
         logger.info("Health check manager initialisé")
     except Exception as e:
         logger.warning(f"Impossible d'initialiser le health manager: {e}")
 
 # ───── Fonctions utilitaires ─────────────────────────────────────────
 
-def _append_log(conv_id: str, header_dt: str, role: str, text: str) -> None:
+# File consommée par `_log_writer` ; None tant que l'écrivain n'est pas démarré
+_log_queue: asyncio.Queue | None = None
+
+
+async def _append_log(conv_id: str, header_dt: str, ts: str,
+                      entries: list[tuple[str, str]]) -> None:
     """
-    Ajoute une entrée dans le fichier de log de conversation.
+    Ajoute les entrées (rôle, texte) d'une requête au fichier de conversation
+    en une seule écriture asynchrone, sans bloquer la boucle d'événements.
     
     Args:
         conv_id: Identifiant unique de la conversation
         header_dt: Timestamp formaté pour le nom de fichier
-        role: Rôle de l'émetteur (user, bot, news, prompt)
-        text: Contenu du message à logger
+        ts: Horodatage ISO 8601 (UTC) des entrées, calculé une fois par requête
+        entries: Couples (rôle, texte) à journaliser (user, news, prompt, bot)
     
     Note:
-        Crée automatiquement le fichier avec en-tête si première utilisation
+        L'en-tête daté n'est écrit que si le fichier est vide à l'ouverture en
+        mode ajout (position 0), sans stat() préalable ni état par fichier.
+        Quand l'écrivain de fond tourne, le texte est simplement mis en file ;
+        sinon (tests, usage hors lifespan) il est écrit directement.
     """
     file = LOG_DIR / f"conv-{conv_id}_{header_dt}.txt"
-    is_new = not file.exists()
-    now = datetime.now(timezone.utc)
-    ts = now.isoformat(timespec="seconds").replace("+00:00", "Z")
+    header = f"# Conversation {conv_id} – démarrée le {header_dt}\n\n"
+    body = "".join(f"[{ts}] {role.upper()}: {text}\n" for role, text in entries)
+    if _log_queue is not None:
+        await _log_queue.put((file, header, body))
+        return
+    async with aiofiles.open(file, "a", encoding="utf-8") as f:
+        # En mode ajout, l'ouverture place la position en fin de fichier
+        await f.write(body if await f.tell() else header + body)
+
+
+async def _log_writer(queue: asyncio.Queue) -> None:
+    """
+    Écrivain de fond des logs de conversation.
+    
+    Consomme la file alimentée par `_append_log` et accumule les entrées dans
+    un tampon par conversation ; un tampon est écrit d'un seul `write()` (fichier
+    non bufferisé en mode ajout) dès qu'il atteint `LOG_BUFFER_SIZE` octets, et
+    tous le sont au plus tard toutes les `LOG_FLUSH_INTERVAL` secondes. Les
+    fichiers restent ouverts (au plus `LOG_MAX_OPEN_FILES`, fermeture du moins
+    récent) ; l'en-tête est ajouté si le fichier est vide à son ouverture.
+    S'arrête sur la sentinelle `None`, après avoir écrit tout ce qui la
+    précède, puis ferme les fichiers.
+    """
+    handles: OrderedDict[Path, Any] = OrderedDict()
+    buffers: Dict[Path, bytearray] = {}
+    headers: Dict[Path, str] = {}
+    last_flush = time.monotonic()
     
-    with file.open("a", encoding="utf-8") as f:
-        if is_new:
-            f.write(f"# Conversation {conv_id} – démarrée le {header_dt}\n\n")
-        f.write(f"[{ts}] {role.upper()}: {text}\n")
+    async def flush(file: Path) -> None:
+        data = buffers.pop(file)
+        header = headers.pop(file)
+        try:
+            f = handles.get(file)
+            if f is None:
+                if len(handles) >= LOG_MAX_OPEN_FILES:
+                    _, oldest = handles.popitem(last=False)
+                    await oldest.close()
+                f = handles[file] = await aiofiles.open(file, "ab", buffering=0)
+                if not await f.tell():
+                    data[:0] = header.encode("utf-8")
+            else:
+                handles.move_to_end(file)
+            await f.write(bytes(data))
+        except OSError as e:
+            logger.error(f"Écriture du log de conversation impossible ({file}): {e}")
+    
+    try:
+        while True:
+            timeout = max(0.0, LOG_FLUSH_INTERVAL - (time.monotonic() - last_flush))
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout if buffers else None)
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                break
+            if item:
+                file, header, text = item
+                headers.setdefault(file, header)
+                buf = buffers.setdefault(file, bytearray())
+                buf += text.encode("utf-8")
+                if len(buf) >= LOG_BUFFER_SIZE:
+                    await flush(file)
+            if buffers and time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL:
+                for file in list(buffers):
+                    await flush(file)
+                last_flush = time.monotonic()
+    finally:
+        for file in list(buffers):
+            await flush(file)
+        for f in handles.values():
+            await f.close()
 
 # ───── Intégration NewsAPI avec resilience ──────────────────────────
 
-# Décorateur de retry pour les appels réseaux
+# Mots vides français (et tournures temporelles) ignorés dans les requêtes NewsAPI
+_FR_STOPWORDS = frozenset("""
+a à au aux avec ce ces cette c ça d dans de des du en et est il ils je j l la le les
+leur leurs lui ma mais me mes moi mon ne nous on ou où par pas pour qu que quel quelle
+quelles quels qui sa se ses son sont sur ta te tes toi ton tu un une vos votre vous y
+été être avoir ont fait faire peux peut pouvez comment pourquoi quoi quand combien
+passe passé arrive neuf sais savoir parle parlez dis dites donne donnez moi plus très tout tous toute toutes
+dernier dernière derniers dernières récent récente récents récentes nouveau nouvelle
+nouveaux nouvelles actuel actuelle actuels actuelles aujourd hui actualité actualités
+actu info infos news sujet concernant propos
+""".split())
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_MAX_KEYWORDS = 4
+# Questions sans rapport avec l'actualité : code (bloc, mots-clés de langage) ou calcul
+_NO_NEWS_RE = re.compile(
+    r"```|^\s*(?:def|class|import|from|#include|SELECT)\b|^[\d\s+\-*/^%().,=?]+$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def _keywords(question: str) -> str:
+    """
+    Réduit une question à une forme canonique de mots-clés pour NewsAPI.
+    
+    Les formulations équivalentes (« Quelles sont les dernières avancées en IA
+    générative ? » / « avancées IA générative récentes ») donnent la même
+    requête, donc la même clé de cache et un seul appel NewsAPI.
+    
+    Args:
+        question (str): Question brute de l'utilisateur
+        
+    Returns:
+        str: Jusqu'à 4 mots-clés en minuscules, dédoublonnés et triés
+            (la question en minuscules si aucun mot-clé n'est trouvé)
+    """
+    keywords: list[str] = []
+    for word in _WORD_RE.findall(question.lower()):
+        if len(word) < 2 or word in _FR_STOPWORDS or word.isdigit() or word in keywords:
+            continue
+        keywords.append(word)
+        if len(keywords) == _MAX_KEYWORDS:
+            break
+    return " ".join(sorted(keywords)) or question.lower().strip()
+
+
+
+def _needs_news(question: str) -> bool:
+    """
+    Indique si la recherche NewsAPI a une chance d'enrichir la réponse.
+    
+    Écarte le code, les calculs et les questions sans aucun mot-clé une fois
+    les mots vides retirés : l'aller-retour NewsAPI (100-500 ms) n'y ramènerait
+    que des articles hors sujet.
+    """
+    if _NO_NEWS_RE.search(question):
+        return False
+    return any(
+        len(word) >= 2 and word not in _FR_STOPWORDS and not word.isdigit()
+        for word in _WORD_RE.findall(question.lower())
+    )
+
+# Appels NewsAPI en cours, partagés par les requêtes concurrentes de même clé
+_news_inflight: Dict[tuple, asyncio.Task] = {}
+
+
+def _news_flight_key(query: str, from_date: str, sort: str, max_results: int) -> tuple:
+    """Clé de coalescence, normalisée comme celle du cache d'actualités"""
+    return (query.lower().strip(), from_date, sort, max_results)
+
+
+async def _single_flight(key: tuple, fetch) -> Any:
+    """
+    Exécute `fetch()` une seule fois par clé parmi les appels simultanés.
+    
+    Sur un défaut de cache, N requêtes identiques n'émettent qu'un appel
+    amont ; les suivantes attendent son résultat. `asyncio.shield` évite
+    qu'un client qui se déconnecte n'annule l'appel pour les autres.
+    
+    Args:
+        key (tuple): Clé normalisée de la requête
+        fetch: Coroutine sans argument effectuant l'appel et la mise en cache
+        
+    Returns:
+        Any: Résultat partagé de `fetch()`
+    """
+    task = _news_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _news_inflight[key] = task
+        task.add_done_callback(lambda _: _news_inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
 if retry_with_backoff:
-    @retry_with_backoff(max_attempts=3, exceptions=(requests.exceptions.RequestException,))
-    def format_news_context(query="Generative AI", from_date="2025-07-01", sort="relevancy", max_results=5):
+    async def format_news_context(query="Generative AI", from_date="2025-07-01", sort="relevancy", max_results=5):
         """
         Récupère les actualités avec cache, circuit breaker et retry automatique.
         
         Cette fonction implémente plusieurs patterns de resilience :
         - Cache intelligent pour éviter les appels répétitifs
         - Circuit breaker pour protéger contre les pannes d'API
-        - Retry avec backoff exponentiel pour les erreurs temporaires
+        - Retry avec backoff exponentiel pour les erreurs temporaires (réseau,
+          5xx), à l'intérieur du circuit breaker
         
         Args:
             query (str): Terme de recherche pour les actualités
@@ -158,72 +464,81 @@ if retry_with_backoff:
             max_results (int): Nombre maximum d'articles à récupérer
             
         Returns:
-            str: Articles formatés en texte ou message d'erreur
+            tuple[str, int]: Articles formatés en texte (ou message d'erreur)
+                et nombre d'articles retenus
             
         Raises:
             Exception: En cas d'erreur non récupérable après tous les retries
         """
         # Étape 1: Vérification du cache intelligent
         if cache_manager and cache_manager.news_cache:
-            cached_result = cache_manager.news_cache.get_news(query, from_date, sort, max_results)
+            cached_result = await cache_manager.news_cache.get_news(query, from_date, sort, max_results)
             if cached_result is not None:
                 logger.info(f"Cache hit pour la requête NewsAPI: {query[:50]}...")
-                return cached_result
+                return tuple(cached_result)  # liste après un aller-retour JSON par Redis
 
-        # Étape 2: Application du circuit breaker pour protection
-        if news_api_circuit_breaker:
-            @news_api_circuit_breaker
-            def _fetch_news():
-                return _fetch_news_api(query, from_date, sort, max_results)
-            
-            try:
-                result = _fetch_news()
-                logger.info(f"NewsAPI appelé avec succès pour: {query[:50]}...")
-                # Marquer l'utilisation réussie pour optimiser les health checks
-                if health_manager:
+        async def _fetch_and_cache():
+            # Étape 2: Application du circuit breaker pour protection
+            if news_api_circuit_breaker:
+                @news_api_circuit_breaker
+                async def _fetch_news():
+                    return await _fetch_news_with_retry(query, from_date, sort, max_results)
+                
+                try:
+                    result = await _fetch_news()
+                    logger.info(f"NewsAPI appelé avec succès pour: {query[:50]}...")
+                    # Marquer l'utilisation réussie pour optimiser les health checks
+                    if health_manager:
+                        health_manager.mark_service_success('newsapi')
+                except Exception as e:
+                    logger.error(f"Circuit breaker ouvert ou erreur NewsAPI: {e}")
+                    return "[ERREUR] Service d'actualités temporairement indisponible. Merci de réessayer plus tard.", 0
+            else:
+                # Fallback sans circuit breaker
+                result = await _fetch_news_with_retry(query, from_date, sort, max_results)
+                # Marquer le succès si pas d'erreur
+                if health_manager and not result[0].startswith("["):
                     health_manager.mark_service_success('newsapi')
-            except Exception as e:
-                logger.error(f"Circuit breaker ouvert ou erreur NewsAPI: {e}")
-                return "[ERREUR] Service d'actualités temporairement indisponible. Merci de réessayer plus tard."
-        else:
-            # Fallback sans circuit breaker
-            result = _fetch_news_api(query, from_date, sort, max_results)
-            # Marquer le succès si pas d'erreur
-            if health_manager and not result.startswith("["):
-                health_manager.mark_service_success('newsapi')
-        
-        # Étape 3: Mise en cache du résultat pour éviter futurs appels
-        if cache_manager and cache_manager.news_cache and not result.startswith("["):
-            cache_manager.news_cache.set_news(query, from_date, sort, max_results, result)
-            logger.debug(f"Résultat mis en cache pour: {query[:50]}...")
+            
+            # Étape 3: Mise en cache du résultat pour éviter futurs appels
+            if cache_manager and cache_manager.news_cache and not result[0].startswith("["):
+                await cache_manager.news_cache.set_news(query, from_date, sort, max_results, result)
+                logger.debug(f"Résultat mis en cache pour: {query[:50]}...")
+            
+            return result
         
-        return result
+        # Les requêtes simultanées sur la même clé partagent un seul appel NewsAPI
+        return await _single_flight(_news_flight_key(query, from_date, sort, max_results), _fetch_and_cache)
 else:
     # Version simplifiée sans retry si module non disponible
-    def format_news_context(query="Generative AI", from_date="2025-07-01", sort="relevancy", max_results=5):
+    async def format_news_context(query="Generative AI", from_date="2025-07-01", sort="relevancy", max_results=5):
         """Version simplifiée sans patterns de resilience."""
         if cache_manager and cache_manager.news_cache:
-            cached_result = cache_manager.news_cache.get_news(query, from_date, sort, max_results)
+            cached_result = await cache_manager.news_cache.get_news(query, from_date, sort, max_results)
             if cached_result is not None:
-                return cached_result
-        
-        result = _fetch_news_api(query, from_date, sort, max_results)
+                return tuple(cached_result)
         
-        # Marquer le succès si pas d'erreur
-        if health_manager and not result.startswith("["):
-            health_manager.mark_service_success('newsapi')
-        
-        if cache_manager and cache_manager.news_cache and not result.startswith("["):
-            cache_manager.news_cache.set_news(query, from_date, sort, max_results, result)
+        async def _fetch_and_cache():
+            result = await _fetch_news_api(query, from_date, sort, max_results)
+            
+            # Marquer le succès si pas d'erreur
+            if health_manager and not result[0].startswith("["):
+                health_manager.mark_service_success('newsapi')
+            
+            if cache_manager and cache_manager.news_cache and not result[0].startswith("["):
+                await cache_manager.news_cache.set_news(query, from_date, sort, max_results, result)
+            
+            return result
         
-        return result
+        return await _single_flight(_news_flight_key(query, from_date, sort, max_results), _fetch_and_cache)
 
-def _fetch_news_api(query: str, from_date: str, sort: str, max_results: int) -> str:
+async def _fetch_news_api(query: str, from_date: str, sort: str, max_results: int) -> tuple[str, int]:
     """
     Fonction interne pour récupérer les actualités depuis NewsAPI.
     
-    Cette fonction effectue l'appel HTTP réel vers l'API NewsAPI et traite
-    la réponse pour la formater en texte utilisable par le modèle IA.
+    Cette fonction effectue l'appel HTTP réel vers l'API NewsAPI via le client
+    `httpx.AsyncClient` partagé (créé dans le lifespan) et traite la réponse
+    pour la formater en texte utilisable par le modèle IA.
     
     Args:
         query (str): Terme de recherche pour les actualités
@@ -232,27 +547,35 @@ def _fetch_news_api(query: str, from_date: str, sort: str, max_results: int) ->
         max_results (int): Nombre maximum d'articles à récupérer
         
     Returns:
-        str: Articles formatés en texte ou message d'erreur
+        tuple[str, int]: Articles formatés en texte (ou message d'erreur) et
+            nombre d'articles retenus, compté à la construction
         
     Raises:
-        requests.exceptions.RequestException: En cas d'erreur réseau
-        ValueError: En cas de réponse malformée
+        httpx.TransportError: Erreur réseau transitoire (connexion, délai)
+        httpx.HTTPStatusError: Erreur serveur NewsAPI (5xx)
+        Exception: Réponse malformée
     """
-    url = (f'https://newsapi.org/v2/everything?'
-           f'q={query}&'
-           f'from={from_date}&'
-           f'sortBy={sort}&'
-           f'pageSize={max_results}&'
-           f'language=fr&'
-           f'apiKey={API_KEY}')
+    params = {
+        "q": query,
+        "from": from_date,
+        "sortBy": sort,
+        "pageSize": max_results,
+        "language": "fr",
+        "apiKey": API_KEY,
+    }
     
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-    except requests.exceptions.RequestException as e:
+        resp = await app.state.http.get(NEWSAPI_URL, params=params)
+    except httpx.TransportError as e:
+        # Erreur transitoire relevée telle quelle pour le retry
         logging.error(f"NewsAPI connection error: {e}")
-        raise Exception("Impossible de se connecter à NewsAPI. Merci de réessayer plus tard.")
+        raise
+    if resp.status_code >= 500:
+        resp.raise_for_status()
+    try:
+        # NewsAPI renvoie un corps JSON (status/code/message) y compris en
+        # cas d'erreur client (429, 401...) : on l'analyse plutôt que de lever
+        data = _json_loads(resp.content)
     except Exception as e:
         logging.error(f"NewsAPI unknown error: {e}")
         raise Exception("Erreur lors du traitement de la réponse NewsAPI.")
@@ -260,67 +583,681 @@ def _fetch_news_api(query: str, from_date: str, sort: str, max_results: int) ->
     if data.get("status") != "ok" or "articles" not in data:
         if data.get("code") == "rateLimited":
             logging.warning("NewsAPI rate limit reached")
-            return "[RATE LIMIT] Le nombre maximal de requêtes NewsAPI a été atteint pour cette période. Merci de réessayer plus tard."
+            return "[RATE LIMIT] Le nombre maximal de requêtes NewsAPI a été atteint pour cette période. Merci de réessayer plus tard.", 0
         logging.warning(f"NewsAPI error: {data.get('message')}")
-        return "[ERREUR] NewsAPI n'a pas pu fournir d'articles pour le moment."
+        return "[ERREUR] NewsAPI n'a pas pu fournir d'articles pour le moment.", 0
 
     if not data["articles"]:
-        return ""
+        return "", 0
     
     # On extrait un résumé formaté pour chaque article
-    return "\n".join(
-        f"- {art['title']} ({art.get('source', {}).get('name','')}, {art['publishedAt'][:10]}) — {art.get('description','')}\n  {art['url']}"
-        for art in data["articles"][:max_results]
-    )
+    lines: list[str] = []
+    append = lines.append
+    for art in data["articles"][:max_results]:
+        source_name = (art.get("source") or {}).get("name", "")
+        published = art["publishedAt"][:10]
+        description = art.get("description") or ""
+        append(f"- {art['title']} ({source_name}, {published}) — {description}\n  {art['url']}")
+    return "\n".join(lines), len(lines)
 
-# dossier où l’on écrit les journaux (créé au boot)
-LOG_DIR = Path("/app/volume/conversations")
-LOG_DIR.mkdir(parents=True, exist_ok=True)
 
-def _append_log(conv_id: str, header_dt: str, role: str, text: str) -> None:
+if retry_with_backoff:
+    # Retry au plus près de l'appel HTTP, sur les seules erreurs transitoires :
+    # le circuit breaker ne compte qu'un échec par série de tentatives
+    _fetch_news_with_retry = retry_with_backoff(
+        max_attempts=3, exceptions=(httpx.TransportError, httpx.HTTPStatusError)
+    )(_fetch_news_api)
+
+
+async def _latest_published_at(query: str) -> str | None:
     """
-    Ajoute une ligne au fichier de conversation.
-    Crée le fichier + un en-tête daté si c’est le premier appel.
+    Date de publication de l'article le plus récent pour une requête (sonde pageSize=1).
+    
+    Raises:
+        ValueError: Réponse autre qu'un succès NewsAPI (quota atteint, clé
+            invalide, erreur serveur) : elle ne renseigne pas sur la fraîcheur
     """
-    file = LOG_DIR / f"conv-{conv_id}_{header_dt}.txt"
-    is_new = not file.exists()
-    now = datetime.now(timezone.utc)
-    ts = now.isoformat(timespec="seconds").replace("+00:00", "Z")
-    with file.open("a", encoding="utf-8") as f:
-        if is_new:
-            f.write(f"# Conversation {conv_id} – démarrée le {header_dt}\n\n")
-        f.write(f"[{ts}] {role.upper()}: {text}\n")
+    params = {
+        "q": query,
+        "sortBy": "publishedAt",
+        "pageSize": 1,
+        "language": "fr",
+        "apiKey": API_KEY,
+    }
+    resp = await app.state.http.get(NEWSAPI_URL, params=params)
+    data = _json_loads(resp.content)
+    if resp.status_code != 200 or data.get("status") != "ok":
+        raise ValueError(f"HTTP {resp.status_code} ({data.get('code') or data.get('message')})")
+    articles = data.get("articles") or []
+    return articles[0].get("publishedAt") if articles else None
 
 
+# Les sondes partagent la protection des appels d'actualités : elles comptent
+# dans le budget NewsAPI et ne sont pas émises quand le circuit est ouvert
+if news_api_circuit_breaker:
+    _latest_published_at = news_api_circuit_breaker(_latest_published_at)
+if news_api_rate_limiter:
+    _latest_published_at = news_api_rate_limiter(_latest_published_at)
+
+
+async def _news_invalidation_loop() -> None:
+    """
+    Invalidation active du cache d'actualités, à fraîcheur bornée.
+    
+    Toutes les `NEWS_INVALIDATION_INTERVAL` secondes, sonde l'article le plus
+    récent des requêtes les plus sollicitées ; si la date a changé depuis la
+    sonde précédente, les entrées de la requête sont invalidées. Le TTL du
+    cache ne sert plus que de filet de sécurité. Une sonde en échec (quota,
+    circuit ouvert…) ou sans article conserve la date de référence connue.
+    """
+    latest_seen: Dict[str, str] = {}
+    while True:
+        await asyncio.sleep(NEWS_INVALIDATION_INTERVAL)
+        news_cache = cache_manager.news_cache
+        probed: Dict[str, str] = {}
+        for query in news_cache.hot_queries(NEWS_INVALIDATION_MAX_QUERIES):
+            try:
+                latest = await _latest_published_at(query)
+            except Exception as e:
+                logger.warning(f"Sonde de fraîcheur NewsAPI en échec pour '{query}': {e}")
+                latest = None
+            if latest is None:
+                if query in latest_seen:
+                    probed[query] = latest_seen[query]
+                continue
+            probed[query] = latest
+            if query in latest_seen and latest != latest_seen[query]:
+                count = await news_cache.invalidate_query(query)
+                cache_manager.answer_cache.invalidate_query(query)
+                logger.info("Nouveaux articles pour '%s' : %d entrée(s) invalidée(s)", query, count)
+        latest_seen = probed
+
 # ───── Hugging Face pipeline (lazy‑load + cache) ─────────────────────
-@lru_cache(maxsize=1)
-def get_pipe():
-    """Charge le modèle Qwen 7B une seule fois (GPU si dispo).
-    Utilise un cache LRU pour éviter de recharger le modèle à chaque appel.
+def _select_torch_dtype() -> torch.dtype:
+    """Choisit la précision des poids selon le matériel disponible.
+    BF16 sur GPU Ampere/Hopper, FP16 sur GPU plus anciens, FP32 sur CPU.
+    Returns:
+        torch.dtype: Type de données utilisé pour charger le modèle.
+    """
+    if torch.cuda.is_available():
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    return torch.float32
+
+
+def _select_attn_implementation() -> str:
+    """Active FlashAttention-2 si un GPU et le paquet `flash-attn` sont présents.
+    Sinon, `scaled_dot_product_attention` de PyTorch (noyaux fusionnés, sans
+    matrice d'attention complète en mémoire), disponible sur GPU comme sur CPU.
+    Returns:
+        str: Backend d'attention passé à `from_pretrained`.
+    """
+    if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+        return "flash_attention_2"
+    return "sdpa"
+
+
+def _build_quantization_config(compute_dtype: torch.dtype) -> BitsAndBytesConfig | None:
+    """Construit la configuration bitsandbytes correspondant à `TW3_QUANT`.
+    La quantification n'est appliquée que sur GPU (bitsandbytes requiert CUDA).
+    Args:
+        compute_dtype: Précision utilisée pour les calculs des couches 4 bits.
+    Returns:
+        BitsAndBytesConfig | None: Configuration à passer au modèle, ou None.
+    """
+    if QUANT_MODE == "bf16" or not torch.cuda.is_available():
+        return None
+    if QUANT_MODE == "int8":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_compute_dtype=compute_dtype,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+    )
+
+
+def build_pipeline():
+    """Charge le modèle Qwen 7B (GPU si dispo).
+    Les poids sont chargés explicitement en demi-précision (BF16/FP16) avec
+    FlashAttention-2 quand c'est possible, au lieu du FP32 par défaut, et
+    quantifiés en NF4/INT8 selon `TW3_QUANT` (≈4.5 Go de VRAM en NF4).
+    Appelée une seule fois par le lifespan, qui conserve l'instance dans
+    `app.state.pipe` : le chemin chaud n'a plus de cache à interroger.
     Returns:
         pipeline: Instance de pipeline pour la génération de texte.
     """
-    logger.info("Loading Qwen pipeline… (first call only)")
-    return pipeline(
-        "text-generation",
-        model="Qwen/Qwen2.5-Coder-7B-Instruct",
-        device_map="auto",       # GPU si présent, sinon CPU
+    dtype = _select_torch_dtype()
+    attn_implementation = _select_attn_implementation()
+    quantization_config = _build_quantization_config(dtype)
+    logger.info(
+        "Loading Qwen pipeline… (dtype=%s, attention=%s, quant=%s)",
+        dtype, attn_implementation,
+        QUANT_MODE if quantization_config else "none"
+    )
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        MODEL_NAME,
+        torch_dtype=dtype,
+        attn_implementation=attn_implementation,
+        quantization_config=quantization_config,
+        device_map="auto",        # GPU si présent, sinon CPU
         trust_remote_code=True    # nécessaire pour Qwen
     )
+    if TORCH_COMPILE and torch.cuda.is_available():
+        # Chaque pas de décodage rejoue le même graphe : compilé une fois, il
+        # évite le surcoût Python/dispatcher par token. On compile `forward`
+        # (appelé par `generate`) plutôt que le module entier.
+        logger.info("Compilation du décodeur (torch.compile, reduce-overhead)…")
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+        # Cache KV statique : formes fixes d'un pas à l'autre, condition pour que
+        # les CUDA graphs capturés soient rejoués au lieu d'être recompilés
+        model.generation_config.cache_implementation = "static"
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def build_draft_model():
+    """Charge le modèle brouillon du décodage spéculatif (`TW3_DRAFT_MODEL`).
+    Il propose `NUM_ASSISTANT_TOKENS` tokens que le modèle principal vérifie en
+    une seule passe : la sortie est celle du modèle principal, en moins de pas.
+    Returns:
+        AutoModelForCausalLM: Modèle brouillon, sur le même périphérique.
+    """
+    logger.info("Loading draft model %s for speculative decoding…", DRAFT_MODEL_NAME)
+    return AutoModelForCausalLM.from_pretrained(
+        DRAFT_MODEL_NAME,
+        torch_dtype=_select_torch_dtype(),
+        attn_implementation=_select_attn_implementation(),
+        device_map="auto",
+        trust_remote_code=True,
+    )
+
+
+def _warmup_pipeline(pipe) -> None:
+    """Génération factice déclenchant la compilation avant la première requête.
+    Le budget passe par les mêmes paliers que les requêtes : le cache statique
+    alloué ici est celui que réutilisera la première génération."""
+    pipe(
+        [{"role": "user", "content": "Bonjour"}],
+        max_new_tokens=_bucket_max_new_tokens(8),
+        do_sample=False,
+    )
+
+
+def _bucket_max_new_tokens(max_new_tokens: int) -> int:
+    """
+    Arrondit `max_new_tokens` au palier supérieur quand le décodeur est compilé.
+    
+    La génération s'arrête de toute façon sur EOS ; des budgets fixes maximisent
+    la réutilisation des graphes déjà capturés.
+    
+    Args:
+        max_new_tokens (int): Budget demandé
+        
+    Returns:
+        int: Budget effectif
+    """
+    if not TORCH_COMPILE:
+        return max_new_tokens
+    for bucket in MAX_NEW_TOKENS_BUCKETS:
+        if max_new_tokens <= bucket:
+            return bucket
+    return max_new_tokens
+
+
+_CHAT_SENTINEL = "\x00prompt\x00"
+
+
+def build_prompt_prefixes(tokenizer) -> tuple[str, str, Dict[str, list[int]]]:
+    """
+    Pré-tokenise une fois le gabarit de chat et les blocs d'instructions statiques.
+    
+    Args:
+        tokenizer: Tokenizer du pipeline chargé
+        
+    Returns:
+        tuple: (en-tête du gabarit, fin du gabarit, ids de chaque préfixe
+            « en-tête + instructions »)
+    """
+    rendered = tokenizer.apply_chat_template(
+        [{"role": "user", "content": _CHAT_SENTINEL}],
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+    head, tail = rendered.split(_CHAT_SENTINEL)
+    prefix_ids = {
+        instructions: tokenizer(head + instructions, add_special_tokens=False).input_ids
+        for instructions in (INSTRUCTIONS_WITH_NEWS, INSTRUCTIONS_NO_NEWS)
+    }
+    return head, tail, prefix_ids
+
+
+def _encode_prompt(tokenizer, prompt_prefixes: tuple[str, str, Dict[str, list[int]]],
+                   prompt: str) -> list[int]:
+    """
+    Encode le prompt au format chat en réutilisant les préfixes pré-tokenisés.
+    
+    Seule la partie variable (question, actualités) est tokenisée à chaque appel ;
+    la coupure tombe après le double saut de ligne final des instructions, où le
+    pré-tokeniseur de Qwen sépare de toute façon les segments.
+    
+    Args:
+        tokenizer: Tokenizer du pipeline chargé
+        prompt_prefixes (tuple): Résultat de `build_prompt_prefixes`
+        prompt (str): Prompt complet construit par `_prepare_prompt`
+        
+    Returns:
+        list[int]: Token ids prêts pour `model.generate`
+    """
+    head, tail, prefix_ids = prompt_prefixes
+    for instructions, ids in prefix_ids.items():
+        if prompt.startswith(instructions):
+            suffix = prompt[len(instructions):] + tail
+            return ids + tokenizer(suffix, add_special_tokens=False).input_ids
+    return tokenizer(head + prompt + tail, add_special_tokens=False).input_ids
+
+
+def build_prefix_caches(model, prompt_prefixes: tuple[str, str, Dict[str, list[int]]]
+                        ) -> list[tuple[list[int], DynamicCache]]:
+    """
+    Précalcule le cache KV de chaque préfixe d'instructions (prefill fait une fois).
+    
+    Args:
+        model: Modèle du pipeline chargé
+        prompt_prefixes (tuple): Résultat de `build_prompt_prefixes`
+        
+    Returns:
+        list: Couples (ids du préfixe, cache KV correspondant)
+    """
+    caches = []
+    with torch.inference_mode():
+        for ids in prompt_prefixes[2].values():
+            cache = DynamicCache()
+            model(torch.tensor([ids], device=model.device), past_key_values=cache, use_cache=True)
+            caches.append((ids, cache))
+    return caches
+
+
+def _prefix_cache_kwargs(input_ids: list[int]) -> Dict[str, Any]:
+    """
+    Copie du cache KV du préfixe d'instructions par lequel commence le prompt.
+    
+    `generate` ne calcule alors le prefill que de la partie variable ; la copie
+    (quelques centaines de tokens) protège le cache partagé des ajouts du décodage.
+    """
+    for ids, cache in getattr(app.state, "prefix_caches", ()):
+        if input_ids[:len(ids)] == ids and len(input_ids) > len(ids):
+            return {"past_key_values": copy.deepcopy(cache)}
+    return {}
+
+
+def _stop_token_kwargs(tokenizer) -> Dict[str, Any]:
+    """
+    Jetons et séquences d'arrêt explicites et pénalité de répétition pour `generate`.
+    
+    Sans `eos_token_id`/`pad_token_id` explicites, certaines configurations
+    Qwen ne s'arrêtent pas sur `<|im_end|>` et génèrent jusqu'au budget.
+    """
+    return {
+        "eos_token_id": tokenizer.eos_token_id,
+        "pad_token_id": tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+        "repetition_penalty": REPETITION_PENALTY,
+        "stop_strings": list(STOP_SEQUENCES),
+        "tokenizer": tokenizer,
+    }
+
+
+def _sampling_kwargs(temperature: float) -> Dict[str, Any]:
+    """Échantillonnage si temperature > 0, décodage glouton sinon"""
+    if temperature > 0:
+        return {"do_sample": True, "temperature": temperature}
+    return {"do_sample": False}
+
+
+def _assisted_kwargs(batch_size: int) -> Dict[str, Any]:
+    """Modèle brouillon pour `generate` (décodage spéculatif, un seul prompt à la fois)"""
+    draft = getattr(app.state, "draft_model", None)
+    if draft is None or batch_size != 1:
+        return {}
+    return {"assistant_model": draft, "num_assistant_tokens": NUM_ASSISTANT_TOKENS}
+
+
+def _cut_at_stop(text: str) -> str:
+    """Tronque au premier `STOP_SEQUENCES` (Transformers laisse la séquence d'arrêt dans la sortie)"""
+    for stop in STOP_SEQUENCES:
+        text = text.split(stop, 1)[0]
+    return text.strip()
+
+
+def _held_back_stop_prefix(text: str) -> int:
+    """Longueur de la fin de `text` qui pourrait commencer une `STOP_SEQUENCES`"""
+    for size in range(min(len(text), max(map(len, STOP_SEQUENCES)) - 1), 0, -1):
+        tail = text[-size:]
+        if any(stop.startswith(tail) for stop in STOP_SEQUENCES):
+            return size
+    return 0
+
+
+def _input_ids(pipe, prompt: str) -> torch.Tensor:
+    """Tenseur d'entrée `(1, n)` du prompt, sur le périphérique du modèle"""
+    return torch.tensor(
+        [_encode_prompt(pipe.tokenizer, app.state.prompt_prefixes, prompt)],
+        device=pipe.model.device,
+    )
+
+
+def _generate_local(pipe, prompts: list[str], max_new_tokens: int, temperature: float) -> list[str]:
+    """
+    Génère les réponses d'un lot de prompts avec le modèle Transformers local
+    (appel bloquant).
+    
+    Appelle directement `model.generate` sur les ids des prompts (préfixe
+    pré-tokenisé réutilisé), complétés à gauche à la même longueur, et ne
+    décode que les tokens générés, sans passer par le post-traitement du
+    pipeline. Un prompt seul reprend le cache KV précalculé de son préfixe et,
+    avec `TW3_DRAFT_MODEL`, profite du décodage spéculatif.
+    
+    Args:
+        pipe: Pipeline chargé au démarrage (`app.state.pipe`)
+        prompts (list[str]): Les prompts à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer
+        temperature (float): Température d'échantillonnage
+        
+    Returns:
+        list[str]: Les réponses générées, dans l'ordre des prompts, sans le
+            prompt ni tokens spéciaux
+    """
+    tokenizer, model = pipe.tokenizer, pipe.model
+    stop_kwargs = _stop_token_kwargs(tokenizer)
+    encoded = [_encode_prompt(tokenizer, app.state.prompt_prefixes, prompt) for prompt in prompts]
+    width = max(len(ids) for ids in encoded)
+    pad_id = stop_kwargs["pad_token_id"]
+    input_ids = torch.tensor(
+        [[pad_id] * (width - len(ids)) + ids for ids in encoded], device=model.device
+    )
+    attention_mask = torch.tensor(
+        [[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded], device=model.device
+    )
+    # Prompt seul (sans remplissage à gauche) : prefill du préfixe repris du cache
+    cache_kwargs = _prefix_cache_kwargs(encoded[0]) if len(encoded) == 1 else {}
+    with torch.inference_mode():
+        out = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=_bucket_max_new_tokens(max_new_tokens),
+            **_sampling_kwargs(temperature),
+            **_assisted_kwargs(len(encoded)),
+            **cache_kwargs,
+            **stop_kwargs,
+        )
+    return [
+        _cut_at_stop(tokenizer.decode(row[width:], skip_special_tokens=True))
+        for row in out
+    ]
+
 
-def generate_answer(prompt: str,
-                    max_new_tokens: int = 4096,
-                    temperature: float = 0.7) -> str:
+async def _generation_loop(queue: asyncio.Queue) -> None:
+    """
+    Boucle de fond propriétaire du modèle local : regroupe les requêtes en lots.
+    
+    Chaque élément de la file est `(prompt, max_new_tokens, temperature, future)`.
+    Les requêtes arrivées pendant la génération précédente sont prises ensemble
+    (au plus `GEN_MAX_BATCH`), regroupées par paramètres de génération et
+    décodées en un seul appel `model.generate` sur `GEN_EXECUTOR`. S'arrête sur
+    la sentinelle `None`, après avoir servi les requêtes qui la précèdent.
+    """
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        item = await queue.get()
+        batch = []
+        while item is not None:
+            batch.append(item)
+            if len(batch) == GEN_MAX_BATCH or queue.empty():
+                break
+            item = queue.get_nowait()
+        running = item is not None
+        
+        groups: Dict[tuple[int, float], list] = {}
+        for prompt, max_new_tokens, temperature, future in batch:
+            if not future.done():
+                groups.setdefault((max_new_tokens, temperature), []).append((prompt, future))
+        pipe = app.state.pipe
+        for (max_new_tokens, temperature), items in groups.items():
+            prompts = [prompt for prompt, _ in items]
+            try:
+                answers = await loop.run_in_executor(
+                    GEN_EXECUTOR,
+                    partial(_generate_local, pipe, prompts, max_new_tokens, temperature)
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), answer in zip(items, answers):
+                if not future.done():
+                    future.set_result(answer)
+
+
+async def _generate_remote(prompt: str, max_new_tokens: int, temperature: float) -> str:
+    """
+    Génère une réponse via le serveur vLLM (API compatible OpenAI).
+    
+    Le serveur applique le continuous batching : les requêtes /ask concurrentes
+    partagent les mêmes passes GPU au lieu d'être sérialisées sur le modèle.
+    L'appel passe par le client dédié `app.state.llm_http`, dont le pool est
+    dimensionné sur le nombre de séquences que le serveur traite en parallèle.
+    
+    Args:
+        prompt (str): Le prompt à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer
+        temperature (float): Température d'échantillonnage
+        
+    Returns:
+        str: La réponse générée par le serveur
+    """
+    resp = await app.state.llm_http.post(
+        "/chat/completions",
+        json=_remote_payload(prompt, max_new_tokens, temperature),
+    )
+    resp.raise_for_status()
+    return str(_json_loads(resp.content)["choices"][0]["message"]["content"]).strip()
+
+
+def _remote_payload(prompt: str, max_new_tokens: int, temperature: float,
+                    stream: bool = False) -> Dict[str, Any]:
+    """Corps de requête /chat/completions pour le serveur vLLM"""
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_new_tokens,
+        "temperature": temperature,
+        "repetition_penalty": REPETITION_PENALTY,  # paramètre étendu de vLLM
+        "stop": list(STOP_SEQUENCES),
+        "stream": stream,
+    }
+
+
+async def _stream_remote(prompt: str, max_new_tokens: int, temperature: float) -> AsyncIterator[str]:
+    """
+    Relaie les fragments générés par le serveur vLLM (SSE au format OpenAI).
+    
+    Args:
+        prompt (str): Le prompt à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer
+        temperature (float): Température d'échantillonnage
+        
+    Yields:
+        str: Fragments de texte dès leur décodage par le serveur
+    """
+    async with app.state.llm_http.stream(
+        "POST",
+        "/chat/completions",
+        json=_remote_payload(prompt, max_new_tokens, temperature, stream=True),
+    ) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            delta = _json_loads(data)["choices"][0]["delta"].get("content")
+            if delta:
+                yield delta
+
+
+def build_vllm_engine():
+    """
+    Charge Qwen dans un moteur vLLM in-process asynchrone (PagedAttention +
+    continuous batching).
+    
+    Le moteur tourne dans la boucle d'événements : les requêtes concurrentes
+    rejoignent le lot en cours à chaque pas de décodage et partagent chaque
+    lecture des poids au lieu d'être décodées une à une ; le préfixe d'instructions commun est réutilisé grâce
+    au cache de préfixes. Avec `VLLM_QUANT`, les poids sont lus en INT4 (AWQ)
+    ou FP8 : le décodage, limité par la bande passante mémoire, accélère
+    d'autant et la VRAM libérée agrandit le cache KV.
+    
+    Returns:
+        vllm.AsyncLLMEngine: Moteur prêt à générer
+    """
+    from vllm import AsyncEngineArgs, AsyncLLMEngine  # dépendance optionnelle (LLM_BACKEND=vllm)
+    
+    engine_args: Dict[str, Any] = {
+        "model": MODEL_NAME,
+        "dtype": "bfloat16",
+        "gpu_memory_utilization": 0.9,
+        "max_model_len": 8192,
+        "enable_prefix_caching": True,
+    }
+    if VLLM_QUANT == "awq":
+        # Checkpoint AWQ publié par Qwen (les noyaux AWQ attendent du FP16)
+        engine_args.update(model=f"{MODEL_NAME}-AWQ", quantization="awq", dtype="float16")
+    elif VLLM_QUANT == "fp8":
+        # Quantification FP8 à la volée : tensor cores FP8 natifs sur Ada/Hopper
+        # (capacité ≥ 8.9), noyaux Marlin (poids FP8, calcul 16 bits) en deçà
+        engine_args.update(quantization="fp8")
+        if torch.cuda.is_available() and torch.cuda.get_device_capability() >= (8, 9):
+            # Cache KV en FP8 E4M3 : moitié moins de bande passante qu'en BF16
+            engine_args.update(kv_cache_dtype="fp8_e4m3")
+    if VLLM_QUANT != "none":
+        engine_args.update(gpu_memory_utilization=0.95, max_num_seqs=256)
+    
+    logger.info("Loading Qwen in vLLM engine… (quant=%s)", VLLM_QUANT)
+    return AsyncLLMEngine.from_engine_args(AsyncEngineArgs(**engine_args))
+
+
+@lru_cache(maxsize=32)
+def _sampling_params(temperature: float, max_new_tokens: int):
+    """`SamplingParams` vLLM, mutualisés par couple (température, budget)"""
+    from vllm import SamplingParams
+    
+    return SamplingParams(
+        temperature=temperature,
+        max_tokens=max_new_tokens,
+        repetition_penalty=REPETITION_PENALTY,
+        stop=list(STOP_SEQUENCES),
+    )
+
+
+async def _stream_vllm(prompt: str, max_new_tokens: int, temperature: float) -> AsyncIterator[str]:
+    """
+    Génère avec le moteur vLLM in-process en publiant les fragments au fil de l'eau.
+    
+    Args:
+        prompt (str): Le prompt à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer
+        temperature (float): Température d'échantillonnage
+        
+    Yields:
+        str: Fragments de texte générés (sans le prompt ni séquences d'arrêt)
+        
+    Note:
+        Le prompt est transmis sous forme d'ids (préfixe pré-tokenisé +
+        partie variable) : vLLM ne repasse ni le gabarit de chat ni son
+        tokenizer sur les instructions statiques. Si le consommateur abandonne
+        le flux, vLLM annule la requête et libère ses blocs de cache KV.
+    """
+    input_ids = _encode_prompt(app.state.llm_tokenizer, app.state.prompt_prefixes, prompt)
+    sent = 0
+    async for output in app.state.llm.generate(
+        {"prompt_token_ids": input_ids},
+        _sampling_params(temperature, max_new_tokens),
+        request_id=uuid4().hex,
+    ):
+        # Texte cumulé depuis le début de la génération
+        text = output.outputs[0].text
+        if len(text) > sent:
+            yield text[sent:]
+            sent = len(text)
+
+
+def _vllm_health_probe(messages, max_new_tokens: int = 10, **kwargs):
+    """
+    Adapte le moteur vLLM à l'appel `pipe(messages, ...)` du health check.
+    
+    Le moteur asynchrone ne peut pas être piloté depuis cet appel synchrone :
+    la sonde rapporte son état plutôt que de lancer une génération.
+    """
+    if app.state.llm.errored:
+        raise RuntimeError("Moteur vLLM en erreur")
+    return [{"generated_text": "ok"}]
+
+
+def _local_health_probe(messages, max_new_tokens: int = 10, **kwargs):
+    """
+    Adapte le modèle Transformers à l'appel `pipe(messages, ...)` du health check.
+    
+    Une génération de test bloquerait la boucle d'événements et doublerait
+    `GEN_EXECUTOR`, qui ne décode qu'une génération à la fois : la sonde vérifie
+    que le pipeline est chargé et que la boucle de génération tourne.
+    """
+    if getattr(app.state, "pipe", None) is None:
+        raise RuntimeError("Pipeline Transformers non chargé")
+    gen_task = getattr(app.state, "gen_task", None)
+    if gen_task is not None and gen_task.done():
+        raise RuntimeError("Boucle de génération arrêtée")
+    return [{"generated_text": "ok"}]
+
+
+async def _generate(prompt: str, max_new_tokens: int, temperature: float) -> str:
+    """Aiguille la génération complète vers le backend choisi par `LLM_BACKEND`"""
+    if LLM_BACKEND == "remote":
+        return await _generate_remote(prompt, max_new_tokens, temperature)
+    
+    if LLM_BACKEND == "vllm":
+        chunks = [text async for text in _stream_vllm(prompt, max_new_tokens, temperature)]
+        return "".join(chunks).strip()
+    
+    loop = asyncio.get_running_loop()
+    if _gen_queue is not None:
+        future = loop.create_future()
+        await _gen_queue.put((prompt, max_new_tokens, temperature, future))
+        return await future
+    pipe = app.state.pipe
+    answers = await loop.run_in_executor(
+        GEN_EXECUTOR,
+        partial(_generate_local, pipe, [prompt], max_new_tokens, temperature)
+    )
+    return answers[0]
+
+
+async def generate_answer(prompt: str,
+                          max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+                          temperature: float = 0.7) -> str:
     """
     Appelle le modèle IA et récupère la réponse texte avec cache intelligent.
     
     Cette fonction gère l'interaction avec le modèle Qwen 2.5-Coder-7B-Instruct,
-    en gérant différents formats de réponse et en optimisant les performances
-    grâce au système de cache.
+    servie localement par Transformers (dans un thread pour ne pas bloquer la
+    boucle d'événements), par un moteur vLLM asynchrone in-process, ou par un
+    serveur vLLM distant selon `LLM_BACKEND`,
+    et optimise les performances grâce au système de cache.
     
     Args:
         prompt (str): La question ou le prompt à envoyer au modèle
-        max_new_tokens (int): Nombre maximum de tokens à générer (défaut: 4096)
+        max_new_tokens (int): Nombre maximum de tokens à générer (défaut: 512)
         temperature (float): Contrôle la créativité de la génération (0.1-1.0, défaut: 0.7)
         
     Returns:
@@ -328,51 +1265,28 @@ def generate_answer(prompt: str,
         
     Raises:
         Exception: Si le modèle ne peut pas être appelé ou si la réponse est invalide
-        RuntimeError: Si le pipeline n'est pas initialisé correctement
         
     Note:
-        Les réponses sont automatiquement mises en cache pour optimiser les performances
-        sur des requêtes similaires.
+        Seules les générations déterministes (temperature == 0, décodage glouton)
+        sont mises en cache, par (prompt, max_new_tokens, temperature) : un
+        échantillon tiré avec temperature > 0 n'est pas resservi ici (la
+        réutilisation des réponses de /ask relève du cache de réponses).
     """
-    # Vérification du cache pour les réponses du modèle
-    if cache_manager and cache_manager.model_cache:
-        cached_response = cache_manager.model_cache.get_response(prompt)
+    # Vérification du cache (clé : empreinte du prompt + paramètres de génération)
+    cache_key = None
+    if cache_manager and cache_manager.model_cache and temperature == 0.0:
+        cache_key = cache_manager.model_cache.make_key(prompt, max_new_tokens, temperature)
+        cached_response = cache_manager.model_cache.get_response(cache_key)
         if cached_response is not None:
-            logger.info("Cache hit pour la génération de réponse")
+            logger.info("Cache hit pour la génération de réponse (clé %s…)", cache_key[:12])
             return cached_response
     
     try:
-        pipe = get_pipe()
-        messages = [{"role": "user", "content": prompt}]
-        out = pipe(
-            messages,
-            max_new_tokens=max_new_tokens,
-            do_sample=True,
-            temperature=temperature,
-        )
-        data = out[0]["generated_text"]
-
-        # Format 1 : Qwen renvoie directement une str
-        if isinstance(data, str):
-            response = data.strip()
-        # Format 2 : liste de messages
-        elif isinstance(data, list):
-            for msg in reversed(data):
-                if isinstance(msg, dict) and msg.get("role") == "assistant":
-                    response = str(msg.get("content", "")).strip()
-                    break
-            else:
-                response = " ".join(
-                    str(m.get("content", "")) if isinstance(m, dict) else str(m)
-                    for m in data
-                ).strip()
-        else:
-            logger.warning("Unexpected generated_text type: %s", type(data))
-            response = str(data).strip()
+        response = await _generate(prompt, max_new_tokens, temperature)
         
         # Mise en cache de la réponse
-        if cache_manager and cache_manager.model_cache and response:
-            cache_manager.model_cache.set_response(prompt, response)
+        if cache_key and response:
+            cache_manager.model_cache.set_response(cache_key, response)
         
         return response
         
@@ -380,6 +1294,131 @@ def generate_answer(prompt: str,
         logger.error(f"Erreur lors de la génération: {e}")
         raise Exception(f"Erreur lors de la génération de la réponse: {str(e)}")
 
+def _generate_to_streamer(model, streamer, **kwargs) -> None:
+    """`model.generate` alimentant `streamer`, clos aussi en cas d'erreur (le
+    consommateur attendrait sinon indéfiniment le fragment suivant)."""
+    try:
+        model.generate(streamer=streamer, **kwargs)
+    except BaseException:
+        streamer.end()
+        raise
+
+
+class _CancelCriteria(StoppingCriteria):
+    """Interrompt `generate` au token suivant dès que `event` est levé"""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+async def _stream_local(pipe, prompt: str, max_new_tokens: int, temperature: float) -> AsyncIterator[str]:
+    """
+    Décode localement en publiant les fragments de texte au fil de l'eau.
+    
+    `model.generate` tourne sur `GEN_EXECUTOR` et alimente un
+    `AsyncTextIteratorStreamer`, consommé sans bloquer la boucle d'événements.
+    Une erreur de génération est relevée à la fin du flux ; si le consommateur
+    abandonne le flux (client SSE déconnecté), le décodage est interrompu pour
+    libérer `GEN_EXECUTOR` au lieu d'aller jusqu'à `max_new_tokens`.
+    
+    Args:
+        pipe: Pipeline chargé au démarrage (`app.state.pipe`)
+        prompt (str): Le prompt à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer
+        temperature (float): Température d'échantillonnage
+        
+    Yields:
+        str: Fragments de texte décodés (sans le prompt ni tokens spéciaux)
+    """
+    tokenizer, model = pipe.tokenizer, pipe.model
+    input_ids = _input_ids(pipe, prompt)
+    cache_kwargs = _prefix_cache_kwargs(input_ids[0].tolist())
+    streamer = AsyncTextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancel = threading.Event()
+    future = GEN_EXECUTOR.submit(
+        _generate_to_streamer,
+        model,
+        streamer,
+        input_ids=input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=_bucket_max_new_tokens(max_new_tokens),
+        **_sampling_kwargs(temperature),
+        **_assisted_kwargs(1),
+        **cache_kwargs,
+        **_stop_token_kwargs(tokenizer),
+        stopping_criteria=StoppingCriteriaList([_CancelCriteria(cancel)]),
+    )
+    try:
+        async for text in streamer:
+            yield text
+    finally:
+        cancel.set()
+        await asyncio.wrap_future(future)
+
+
+async def stream_answer(prompt: str,
+                        max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+                        temperature: float = 0.7) -> AsyncIterator[str]:
+    """
+    Variante streamée de `generate_answer` : produit la réponse par fragments.
+    
+    Le time-to-first-token se limite ainsi au prefill au lieu de la génération
+    complète. La réponse accumulée est mise en cache une fois le flux terminé,
+    aux mêmes conditions que pour `generate_answer` (temperature == 0).
+    
+    Args:
+        prompt (str): La question ou le prompt à envoyer au modèle
+        max_new_tokens (int): Nombre maximum de tokens à générer (défaut: 512)
+        temperature (float): Contrôle la créativité de la génération (défaut: 0.7)
+        
+    Yields:
+        str: Fragments successifs de la réponse
+    """
+    cache_key = None
+    if cache_manager and cache_manager.model_cache and temperature == 0.0:
+        cache_key = cache_manager.model_cache.make_key(prompt, max_new_tokens, temperature)
+        cached_response = cache_manager.model_cache.get_response(cache_key)
+        if cached_response is not None:
+            logger.info("Cache hit pour la génération de réponse (stream, clé %s…)", cache_key[:12])
+            yield cached_response
+            return
+    
+    if LLM_BACKEND == "remote":
+        stream = _stream_remote(prompt, max_new_tokens, temperature)
+    elif LLM_BACKEND == "vllm":
+        stream = _stream_vllm(prompt, max_new_tokens, temperature)
+    else:
+        stream = _stream_local(app.state.pipe, prompt, max_new_tokens, temperature)
+    # Le décodage local ne s'arrête qu'après avoir émis la séquence d'arrêt : la fin
+    # du texte qui pourrait en être le début est retenue jusqu'à être tranchée, et
+    # rien n'est plus publié une fois la séquence complète reçue.
+    text_so_far = ""
+    sent = 0
+    stopped = False
+    async for text in stream:
+        if stopped:
+            continue
+        text_so_far += text
+        cut = min((i for i in map(text_so_far.find, STOP_SEQUENCES) if i >= 0), default=-1)
+        if cut >= 0:
+            text_so_far = text_so_far[:cut]
+            stopped = True
+            end = cut
+        else:
+            end = len(text_so_far) - _held_back_stop_prefix(text_so_far)
+        if end > sent:
+            yield text_so_far[sent:end]
+            sent = end
+    if len(text_so_far) > sent:
+        yield text_so_far[sent:]
+    
+    response = _cut_at_stop(text_so_far)
+    if cache_key and response:
+        cache_manager.model_cache.set_response(cache_key, response)
+
 # ───── Lifespan ───────────────────────────────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -390,15 +1429,65 @@ async def lifespan(app: FastAPI):
     """
     logger.info("Initialisation de l'application TW3...")
     
-    # Pré-chargement du modèle
-    logger.info("Preloading Qwen pipeline for faster responses…")
-    get_pipe()  # déclenche le cache LRU
+    # Pré-chargement du modèle (inutile si la génération est déléguée à vLLM)
+    if LLM_BACKEND == "transformers":
+        logger.info("Preloading Qwen pipeline for faster responses…")
+        app.state.pipe = build_pipeline()
+        app.state.prompt_prefixes = build_prompt_prefixes(app.state.pipe.tokenizer)
+        if TORCH_COMPILE:
+            # Un DynamicCache de préfixe remplacerait le cache statique des graphes compilés
+            app.state.prefix_caches = []
+            _warmup_pipeline(app.state.pipe)
+        else:
+            app.state.prefix_caches = build_prefix_caches(app.state.pipe.model, app.state.prompt_prefixes)
+        app.state.draft_model = build_draft_model() if DRAFT_MODEL_NAME else None
+    elif LLM_BACKEND == "vllm":
+        app.state.llm = build_vllm_engine()
+        app.state.llm_tokenizer = await app.state.llm.get_tokenizer()
+        app.state.prompt_prefixes = build_prompt_prefixes(app.state.llm_tokenizer)
+    else:
+        logger.info("Génération déléguée au serveur vLLM: %s", REMOTE_LLM_URL)
+        # Client dédié : délais longs de génération et pool à la taille du batch vLLM
+        app.state.llm_http = httpx.AsyncClient(
+            base_url=REMOTE_LLM_URL,
+            timeout=REMOTE_LLM_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=REMOTE_LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=REMOTE_LLM_MAX_CONNECTIONS,
+            ),
+        )
+    
+    # Pool de connexions HTTP partagé par les appels NewsAPI : délai court pour
+    # basculer vite sur la réponse de repli, HTTP/2 (multiplexage) si `h2` est installé
+    app.state.http = httpx.AsyncClient(
+        timeout=NEWSAPI_TIMEOUT,
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    )
+    
+    # Boucle de génération par lots du modèle local
+    global _log_queue, _gen_queue
+    gen_task = None
+    if LLM_BACKEND == "transformers":
+        _gen_queue = asyncio.Queue()
+        gen_task = asyncio.create_task(_generation_loop(_gen_queue))
+    app.state.gen_task = gen_task
+    
+    # Écrivain de fond des logs de conversation
+    _log_queue = asyncio.Queue()
+    log_task = asyncio.create_task(_log_writer(_log_queue))
     
     # Démarrage des services de cache
     if cache_manager:
         await cache_manager.start_cleanup_task()
         logger.info("Cache manager started")
     
+    # Invalidation active du cache d'actualités
+    invalidation_task = None
+    if cache_manager and NEWS_INVALIDATION_INTERVAL > 0:
+        invalidation_task = asyncio.create_task(_news_invalidation_loop())
+        logger.info("News cache invalidation started")
+    
     # Démarrage du monitoring
     if health_manager:
         await health_manager.start_background_checks()
@@ -415,9 +1504,31 @@ async def lifespan(app: FastAPI):
         await cache_manager.stop_cleanup_task()
         logger.info("Cache manager stopped")
     
+    if invalidation_task:
+        invalidation_task.cancel()
+        try:
+            await invalidation_task
+        except asyncio.CancelledError:
+            pass
+    
     if health_manager:
         await health_manager.stop_background_checks()
         logger.info("Health monitoring stopped")
+    
+    if gen_task:
+        queue, _gen_queue = _gen_queue, None
+        await queue.put(None)
+        await gen_task
+    
+    # Les écritures en file sont vidées sur disque avant l'arrêt
+    queue, _log_queue = _log_queue, None
+    await queue.put(None)
+    await log_task
+    
+    await app.state.http.aclose()
+    if LLM_BACKEND == "remote":
+        await app.state.llm_http.aclose()
+    logger.info("HTTP client closed")
 
 # ───── FastAPI app ────────────────────────────────────────────────────
 app = FastAPI(title="TW3 Chat Backend", lifespan=lifespan)
@@ -512,6 +1623,128 @@ async def get_metrics() -> Dict[str, Any]:
         logger.error(f"Erreur lors de la récupération des métriques: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de la récupération des métriques")
 
+@lru_cache(maxsize=1)
+def _request_timestamps(sec: int) -> tuple[str, str, str]:
+    """
+    Horodatages UTC d'une requête, formatés une seule fois par seconde.
+    
+    Args:
+        sec (int): Seconde Unix de réception de la requête
+        
+    Returns:
+        tuple: (horodatage du nom de fichier de log, horodatage ISO 8601 des
+            entrées de log, date de début de la recherche NewsAPI à J-30)
+    """
+    t = time.gmtime(sec)
+    return (
+        time.strftime("%Y-%m-%dT%H%M%S", t),
+        time.strftime("%Y-%m-%dT%H:%M:%SZ", t),
+        time.strftime("%Y-%m-%d", time.gmtime(sec - 30 * 86400)),
+    )
+
+
+def _build_prompt(question: str, news_ctx: str | None = None) -> str:
+    """Assemble le prompt à partir des parties précalculées de son gabarit."""
+    if news_ctx:
+        head, middle, tail = _PROMPT_WITH_NEWS
+        return "".join((head, question, middle, news_ctx, tail))
+    head, tail = _PROMPT_NO_NEWS
+    return "".join((head, question, tail))
+
+
+async def _prepare_prompt(conv_id: str, question: str, from_date: str,
+                          log_entries: list[tuple[str, str]],
+                          max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS
+                          ) -> tuple[str | None, str | None, tuple[str, str] | None]:
+    """
+    Recherche les actualités liées à la question et construit le prompt.
+    
+    Étapes communes aux endpoints /ask et /ask/stream. NewsAPI n'est interrogée
+    que si `_needs_news` juge la question liée à l'actualité. Les entrées de journal
+    (news, prompt) sont ajoutées à `log_entries`, écrites en fin de requête.
+    Si la même question a déjà reçu une réponse avec le même contexte
+    d'actualités, cette réponse est renvoyée sans construire de prompt.
+    
+    Args:
+        conv_id (str): Identifiant de la conversation
+        question (str): Question nettoyée de l'utilisateur
+        from_date (str): Date de début de la recherche d'actualités (YYYY-MM-DD)
+        log_entries (list[tuple[str, str]]): Journal (rôle, texte) de la requête
+        max_new_tokens (int): Budget de génération, partie de la clé du cache de réponses
+        
+    Returns:
+        tuple: `(prompt, None, answer_slot)` dans le cas nominal, où
+            `answer_slot` est à passer à `_store_answer` une fois la réponse
+            générée ; `(None, answer, None)` si NewsAPI est indisponible ou si
+            la réponse est en cache (réponse déjà ajoutée au journal)
+    """
+    # Recherche d’actualités
+    sort = "relevancy"
+    max_results = 5
+    news_query = _keywords(question)  # la question complète reste dans le prompt
+    if _needs_news(question):
+        try:
+            # L'appel partagé (cf. `_single_flight`) se poursuit après le délai
+            # et alimente le cache pour les requêtes suivantes
+            news_ctx, n_articles = await asyncio.wait_for(
+                format_news_context(
+                    query=news_query,
+                    from_date=from_date,
+                    sort=sort,
+                    max_results=max_results
+                ),
+                NEWS_DEADLINE,
+            )
+            logger.info("Conv %s – found %d news articles", conv_id, n_articles)
+            log_entries.append(("news", news_ctx or "Aucune information d’actualité trouvée."))
+        except asyncio.TimeoutError:
+            news_ctx = ""
+            logger.warning("Conv %s – NewsAPI sans réponse après %.0f s, réponse sans actualités", conv_id, NEWS_DEADLINE)
+            log_entries.append(("news", "Recherche d’actualités abandonnée (délai dépassé)."))
+    else:
+        news_ctx = ""
+        logger.info("Conv %s – recherche d'actualités ignorée (question hors actualité)", conv_id)
+        log_entries.append(("news", "Recherche d’actualités non effectuée (question hors actualité)."))
+
+    # --- GESTION ERREUR NEWSAPI / RATE LIMIT ---
+    if news_ctx.startswith("[ERREUR]") or news_ctx.startswith("[RATE LIMIT]"):
+        answer = (
+            f"Erreur lors de la récupération des actualités :\n{news_ctx}\n\n"
+            "Je ne peux donc répondre qu'à partir de mes connaissances internes. "
+            "Merci de réessayer dans quelques instants si vous souhaitez une réponse basée sur l’actualité."
+        )
+        log_entries.append(("bot", answer))
+        return None, answer, None
+
+    # Réponse déjà produite pour cette question et ces actualités
+    answer_slot = None
+    if cache_manager:
+        answer_key = cache_manager.answer_cache.make_key(question, news_ctx, max_new_tokens)
+        cached_answer = cache_manager.answer_cache.get_answer(answer_key)
+        if cached_answer is not None:
+            logger.info("Conv %s – réponse servie depuis le cache", conv_id)
+            log_entries.append(("bot", cached_answer))
+            return None, cached_answer, None
+        answer_slot = (news_query, answer_key)
+
+    prompt = _build_prompt(question, news_ctx)
+    logger.info("Conv %s – prompt : %s", conv_id, prompt)
+    log_entries.append(("prompt", prompt))
+    return prompt, None, answer_slot
+
+
+def _store_answer(answer_slot: tuple[str, str] | None, answer: str) -> None:
+    """Met en cache une réponse générée avec succès (cf. `_prepare_prompt`)"""
+    if answer_slot and answer:
+        cache_manager.answer_cache.set_answer(*answer_slot, answer)
+
+
+def _sse_event(data: Dict[str, Any] | str) -> str:
+    """Formate un évènement Server-Sent Events (`data: ...` + ligne vide)."""
+    payload = data if isinstance(data, str) else _json_dumps(data)
+    return f"data: {payload}\n\n"
+
+
 @app.post("/ask", response_model=AskOut, tags=["Chat"])
 async def ask_handler(payload: AskIn) -> AskOut:
     """
@@ -556,76 +1789,80 @@ async def ask_handler(payload: AskIn) -> AskOut:
         }
     """
     conv_id = payload.conv_id or str(uuid4())
-    now = datetime.now(timezone.utc)
-    header_dt = now.strftime("%Y-%m-%dT%H%M%S")
+    header_dt, ts, from_date = _request_timestamps(int(time.time()))
     question = payload.question.strip()
     logger.info("Conv %s – question : %s…", conv_id, question)
-    _append_log(conv_id, header_dt, "user", question)
+    log_entries = [("user", question)]
 
-    # Recherche d’actualités
-    from_date = (now - timedelta(days=30)).strftime("%Y-%m-%d")
-    sort = "relevancy"
-    max_results = 5
-    news_ctx = format_news_context(
-        query=question,
-        from_date=from_date,
-        sort=sort,
-        max_results=max_results
+    max_new_tokens = payload.max_tokens or DEFAULT_MAX_NEW_TOKENS
+    prompt, fallback_answer, answer_slot = await _prepare_prompt(
+        conv_id, question, from_date, log_entries, max_new_tokens
     )
-    logger.info("Conv %s – found %d news articles", conv_id, news_ctx.count("- ") if news_ctx and news_ctx.startswith("-") else 0)
-    _append_log(conv_id, header_dt, "news", news_ctx or "Aucune information d’actualité trouvée.")
-
-    # --- GESTION ERREUR NEWSAPI / RATE LIMIT ---
-    if news_ctx.startswith("[ERREUR]") or news_ctx.startswith("[RATE LIMIT]"):
-        answer = (
-            f"Erreur lors de la récupération des actualités :\n{news_ctx}\n\n"
-            "Je ne peux donc répondre qu'à partir de mes connaissances internes. "
-            "Merci de réessayer dans quelques instants si vous souhaitez une réponse basée sur l’actualité."
-        )
-        _append_log(conv_id, header_dt, "bot", answer)
-        return AskOut(conv_id=conv_id, answer=answer)
-
-    if news_ctx:
-        prompt = (
-            "Réponds à la question suivante uniquement en faisant un résumé des informations fournies et complètes la réponse avec tes connaissances internes si nécessaire."
-            "Précise toujours les sources des informations utilisées. Tu dois restituer la source de chaque information que tu utilises dans ta réponse avec sa date de publication.\n\n"
-            "Ne commence jamais par une excuse de type ‘en tant qu’IA, je n’ai pas accès au web’.\n\n"
-            f"Question : {question}\n\n"
-            "Articles d’actualité à exploiter :\n"
-            f"{news_ctx}\n"
-            "Réponse :"
-        )
-    else:
-        prompt = (
-            "Tu vas répondre à une question en utilisant uniquement tes connaissances internes.\n\n"
-            "INSTRUCTIONS :\n"
-            "- Réponds de manière factuelle et précise.\n"
-            "- N'invente jamais de sources, de liens, de dates ou de citations.\n"
-            "- Indique clairement que tu t'appuies sur tes connaissances générales, sans accès à l'actualité.\n"
-            "- Si la question porte sur des actualités récentes ou des développements très récents, indique que tu ne peux pas fournir de sources d'actualité ou d'exemples récents précis.\n"
-            "- Si la question porte sur des actualités récentes, termine ta réponse comme ceci :\n"
-            "'Pour obtenir des informations actualisées, veuillez poser votre question sous forme de mots-clés simples comme \"IA générative\", \"technologie\", \"cinéma\".'\n\n"
-            "- **IMPORTANT : Termine toujours ta réponse en conseillant à l'utilisateur de reformuler sa question en français avec des mots-clés simples comme 'IA générative', 'technologie', 'cinéma' pour obtenir des informations d'actualité précises.**\n\n"
-            f"Question : {question}\n\n"
-            "Réponse :"
-        )
-
-    logger.info("Conv %s – prompt : %s", conv_id, prompt)
-    _append_log(conv_id, header_dt, "prompt", prompt)
+    if fallback_answer is not None:
+        await _append_log(conv_id, header_dt, ts, log_entries)
+        return AskOut(conv_id=conv_id, answer=fallback_answer)
 
-    # Génération Qwen dans un thread séparé (gestion d’erreur)
+    # Génération Qwen (gestion d’erreur)
     try:
-        loop = asyncio.get_running_loop()
-        answer = await loop.run_in_executor(
-            None,
-            lambda: generate_answer(prompt)
-        )
+        answer = await generate_answer(prompt, max_new_tokens=max_new_tokens)
+        _store_answer(answer_slot, answer)
     except Exception as e:
         logger.error(f"Erreur lors de la génération Qwen : {e}")
-        answer = (
-            "Désolé, une erreur technique est survenue lors de la génération de la réponse. "
-            "Merci de réessayer dans quelques instants."
-        )
+        answer = GENERATION_ERROR_ANSWER
+
+    log_entries.append(("bot", answer))
+    await _append_log(conv_id, header_dt, ts, log_entries)
+    return AskOut(conv_id=conv_id, answer=answer)
+
+
+@app.post("/ask/stream", tags=["Chat"])
+async def ask_stream_handler(payload: AskIn) -> StreamingResponse:
+    """
+    Variante streamée de /ask : la réponse est envoyée en Server-Sent Events.
+    
+    Le workflow est identique à /ask (actualités, prompt, journalisation) mais
+    les fragments de texte sont transmis au client dès leur décodage.
+    
+    Args:
+        payload (AskIn): Question et ID de conversation optionnel
+        
+    Returns:
+        StreamingResponse: Flux `text/event-stream` dont chaque évènement
+            `data:` contient `{"conv_id": ..., "delta": ...}` (ou `"error"`),
+            terminé par `data: [DONE]`
+    """
+    conv_id = payload.conv_id or str(uuid4())
+    header_dt, ts, from_date = _request_timestamps(int(time.time()))
+    question = payload.question.strip()
+    logger.info("Conv %s – question (stream) : %s…", conv_id, question)
+    log_entries = [("user", question)]
+
+    max_new_tokens = payload.max_tokens or DEFAULT_MAX_NEW_TOKENS
+    prompt, fallback_answer, answer_slot = await _prepare_prompt(
+        conv_id, question, from_date, log_entries, max_new_tokens
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        if fallback_answer is not None:
+            await _append_log(conv_id, header_dt, ts, log_entries)
+            yield _sse_event({"conv_id": conv_id, "delta": fallback_answer})
+            yield _sse_event("[DONE]")
+            return
+
+        chunks: list[str] = []
+        try:
+            async for delta in stream_answer(prompt, max_new_tokens=max_new_tokens):
+                chunks.append(delta)
+                yield _sse_event({"conv_id": conv_id, "delta": delta})
+            answer = _cut_at_stop("".join(chunks))
+            _store_answer(answer_slot, answer)
+        except Exception as e:
+            logger.error(f"Erreur lors de la génération Qwen (stream) : {e}")
+            answer = GENERATION_ERROR_ANSWER
+            yield _sse_event({"conv_id": conv_id, "error": answer})
+
+        log_entries.append(("bot", answer))
+        await _append_log(conv_id, header_dt, ts, log_entries)
+        yield _sse_event("[DONE]")
 
-    _append_log(conv_id, header_dt, "bot", answer)
-    return AskOut(conv_id=conv_id, answer=answer)
\ No newline at end of file
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
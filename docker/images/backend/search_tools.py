@@ -1,37 +1,89 @@
 import os
-from dotenv import load_dotenv
-import requests
 import asyncio
+import importlib.util
+import logging
+from dotenv import load_dotenv
+import httpx
+
+try:
+    from orjson import loads as json_loads  # optionnel : analyse JSON plus rapide
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    from cache import NewsCache  # modules d'architecture (src/), copiés dans l'image
+except ImportError:
+    NewsCache = None
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 API_KEY = os.getenv("NEWSAPI_KEY")
 if not API_KEY:
     raise ValueError("NEWSAPI_KEY manquante.")
 
-def format_news_context(query="Generative AI", from_date="2025-07-10", sort="relevancy", max_results=5):
-    url = (f'https://newsapi.org/v2/everything?'
-           f'q={query}&'
-           f'from={from_date}&'
-           f'sortBy={sort}&'
-           f'pageSize={max_results}&'
-           f'language=fr&'
-           f'apiKey={API_KEY}')
-    resp = requests.get(url)
-    data = resp.json()
-    if data.get("status") != "ok" or "articles" not in data:
-        return ""
-    # On extrait un résumé formaté pour chaque article
+NEWSAPI_URL = "https://newsapi.org/v2/everything"
+# Client asynchrone partagé : pool de connexions, HTTP/2 (multiplexage) si `h2` est installé
+CLIENT = httpx.AsyncClient(
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=8,
+)
+# Cache propre à ce module : son format de texte diffère de celui de main.py
+NEWS_CACHE = NewsCache() if NewsCache else None
+
+def _params(query, from_date, sort, max_results):
+    # Paramètres encodés par le client HTTP (espaces, accents, guillemets)
+    return {
+        "q": query,
+        "from": from_date,
+        "sortBy": sort,
+        "pageSize": max_results,
+        "language": "fr",
+        "apiKey": API_KEY,
+    }
+
+def _format_articles(data, max_results):
+    # On extrait un résumé formaté pour chaque article (`source` peut valoir null)
     return "\n".join(
-        f"- {art['title']} ({art.get('source', {}).get('name','')}, {art['publishedAt'][:10]}) — {art.get('description','')}\n  {art['url']}"
+        f"- {art['title']} ({(art.get('source') or {}).get('name','')}, {art['publishedAt'][:10]}) — {art.get('description','')}\n  {art['url']}"
         for art in data["articles"][:max_results]
     )
 
+async def _cached(query, from_date, sort, max_results):
+    if NEWS_CACHE is None:
+        return None
+    return await NEWS_CACHE.get_news(query, from_date, sort, max_results)
+
+async def _store(query, from_date, sort, max_results, context):
+    # Les échecs (chaîne vide) ne sont pas mis en cache
+    if NEWS_CACHE is not None and context:
+        await NEWS_CACHE.set_news(query, from_date, sort, max_results, context)
+    return context
+
+async def format_news_context(query="Generative AI", from_date="2025-07-10", sort="relevancy", max_results=5):
+    cached = await _cached(query, from_date, sort, max_results)
+    if cached is not None:
+        return cached
+    # Appel asynchrone sur le client partagé (aucun thread bloqué)
+    try:
+        resp = await CLIENT.get(NEWSAPI_URL, params=_params(query, from_date, sort, max_results))
+        data = json_loads(resp.content)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"NewsAPI injoignable ou réponse illisible: {e}")
+        return ""
+    # Erreurs NewsAPI (401, 429...) : contexte vide, jamais mis en cache
+    if resp.status_code != 200 or data.get("status") != "ok" or "articles" not in data:
+        logger.warning(f"NewsAPI en erreur ({resp.status_code}): {data.get('message', '')}")
+        return ""
+    return await _store(query, from_date, sort, max_results, _format_articles(data, max_results))
+
 async def search_news_async(query, from_date, sort, max_results=5):
-    # Adapter pour être async : run format_news_context dans un thread
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None, lambda: format_news_context(query, from_date, sort, max_results)
-    )
+    return await format_news_context(query, from_date, sort, max_results)
+
+async def aclose():
+    # Module autonome (main.py ne l'importe pas) : l'appelant ferme le pool à l'arrêt
+    await CLIENT.aclose()
 
 if __name__ == "__main__":
     import argparse
@@ -48,14 +100,20 @@ if __name__ == "__main__":
     args = parser.parse_args()
     query_str = " ".join(args.query)
 
-    # Appel synchrone pour la ligne de commande
+    async def _run():
+        # Une seule boucle : la recherche puis la fermeture du client partagé
+        try:
+            return await format_news_context(
+                query=query_str,
+                from_date=args.from_date,
+                sort=args.sort,
+                max_results=args.max_results
+            )
+        finally:
+            await aclose()
+
     print(f"Recherche actualités pour : {query_str}\n")
-    context = format_news_context(
-        query=query_str,
-        from_date=args.from_date,
-        sort=args.sort,
-        max_results=args.max_results
-    )
+    context = asyncio.run(_run())
 
     if context:
         print(context)
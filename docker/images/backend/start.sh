@@ -2,6 +2,13 @@
 set -e
 
 echo "Démarrage de l'application FastAPI backend..."
-uvicorn main:app --host 0.0.0.0 --port 8000
+# Boucle uvloop et parseur httptools. Plusieurs workers uniquement quand la
+# génération est déléguée au serveur vLLM : chaque worker chargerait sinon
+# sa propre copie du modèle.
+WORKERS="${UVICORN_WORKERS:-1}"
+if [ "${LLM_BACKEND:-transformers}" != "remote" ]; then
+    WORKERS=1
+fi
+uvicorn main:app --host 0.0.0.0 --port 8000 --workers "$WORKERS" --loop uvloop --http httptools
 
 echo "Toutes les applications ont été démarrées avec succès."
\ No newline at end of file
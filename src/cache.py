@@ -2,8 +2,11 @@
 
 import hashlib
 import json
+import os
+import sys
 import time
 import asyncio
+from collections import OrderedDict
 from typing import Any, Optional, Dict, Union
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -11,6 +14,30 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson  # dépendance optionnelle : sérialisation JSON plus rapide
+    
+    def _json_dumps(value: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(value: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(value, sort_keys=sort_keys).encode()
+    
+    _json_loads = json.loads
+
+try:
+    import xxhash  # dépendance optionnelle : empreintes non cryptographiques, plus rapides
+    
+    def _digest(data: bytes) -> str:
+        """Empreinte 128 bits d'une clé de cache (XXH3)"""
+        return xxhash.xxh3_128_hexdigest(data)
+except ImportError:
+    def _digest(data: bytes) -> str:
+        """Empreinte 128 bits d'une clé de cache (BLAKE2b, sans xxhash)"""
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 
 @dataclass
 class CacheEntry:
@@ -19,6 +46,7 @@ class CacheEntry:
     timestamp: float
     ttl: float
     hit_count: int = 0
+    size: int = 0  # octets estimés (clé + valeur), cf. `_sizeof`
     
     @property
     def is_expired(self) -> bool:
@@ -30,27 +58,39 @@ class CacheEntry:
         self.hit_count += 1
 
 
+def _sizeof(value: Any) -> int:
+    """Taille mémoire approximative d'une valeur en cache (un niveau de conteneur)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
 class InMemoryCache:
-    """Cache en mémoire avec TTL et statistiques"""
+    """Cache en mémoire avec TTL, éviction LRU en O(1) et statistiques"""
     
     def __init__(self, max_size: int = 1000, default_ttl: float = 3600):
         self.max_size = max_size
         self.default_ttl = default_ttl
-        self._cache: Dict[str, CacheEntry] = {}
+        # Ordre d'insertion = ordre d'accès : le moins récemment utilisé en tête
+        self._cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0  # somme des `CacheEntry.size`, tenue à jour à chaque mutation
         self._stats = {
             'hits': 0,
             'misses': 0,
             'evictions': 0
         }
     
-    def _make_key(self, key: Union[str, dict, list]) -> str:
+    @staticmethod
+    def _make_key(key: Union[str, dict, list]) -> str:
         """Crée une clé de cache normalisée"""
         if isinstance(key, str):
             return key
-        elif isinstance(key, (dict, list)):
-            # Sérialise et hashe les structures complexes
-            serialized = json.dumps(key, sort_keys=True)
-            return hashlib.md5(serialized.encode()).hexdigest()
+        elif isinstance(key, dict):
+            # Tuple canonique (clés triées) : pas de sérialisation JSON intermédiaire
+            return _digest(repr(sorted(key.items())).encode())
+        elif isinstance(key, list):
+            return _digest(_json_dumps(key, sort_keys=True))
         else:
             return str(key)
     
@@ -65,11 +105,12 @@ class InMemoryCache:
         entry = self._cache[cache_key]
         
         if entry.is_expired:
-            del self._cache[cache_key]
+            self._remove(cache_key)
             self._stats['misses'] += 1
             return None
         
         entry.increment_hits()
+        self._cache.move_to_end(cache_key)
         self._stats['hits'] += 1
         return entry.value
     
@@ -79,33 +120,55 @@ class InMemoryCache:
         ttl = ttl or self.default_ttl
         
         # Éviction si cache plein
-        if len(self._cache) >= self.max_size and cache_key not in self._cache:
+        if cache_key in self._cache:
+            self._bytes -= self._cache[cache_key].size
+            self._cache.move_to_end(cache_key)
+        elif len(self._cache) >= self.max_size:
             self._evict_lru()
         
+        size = sys.getsizeof(cache_key) + _sizeof(value)
         self._cache[cache_key] = CacheEntry(
             value=value,
             timestamp=time.time(),
-            ttl=ttl
+            ttl=ttl,
+            size=size
         )
+        self._bytes += size
+    
+    def delete(self, key: Union[str, dict, list]) -> bool:
+        """Supprime une entrée ; retourne True si elle existait"""
+        return self._remove(self._make_key(key))
+    
+    def _remove(self, cache_key: str) -> bool:
+        """Retire une entrée par clé normalisée en tenant à jour la taille totale"""
+        entry = self._cache.pop(cache_key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.size
+        return True
+    
+    def purge_expired(self) -> int:
+        """Supprime les entrées expirées ; retourne leur nombre"""
+        expired_keys = [key for key, entry in self._cache.items() if entry.is_expired]
+        for key in expired_keys:
+            self._remove(key)
+        return len(expired_keys)
     
     def _evict_lru(self):
         """Éviction LRU (Least Recently Used)"""
         if not self._cache:
             return
         
-        # Trouve l'entrée la moins utilisée
-        lru_key = min(
-            self._cache.keys(),
-            key=lambda k: (self._cache[k].hit_count, self._cache[k].timestamp)
-        )
-        
-        del self._cache[lru_key]
+        # L'entrée la moins récemment utilisée est en tête
+        lru_key, entry = self._cache.popitem(last=False)
+        self._bytes -= entry.size
         self._stats['evictions'] += 1
         logger.debug(f"Cache LRU éviction: {lru_key}")
     
     def clear(self):
         """Vide le cache"""
         self._cache.clear()
+        self._bytes = 0
     
     def get_stats(self) -> Dict[str, Any]:
         """Retourne les statistiques du cache"""
@@ -116,39 +179,171 @@ class InMemoryCache:
             **self._stats,
             'hit_rate': hit_rate,
             'cache_size': len(self._cache),
-            'max_size': self.max_size
+            'max_size': self.max_size,
+            'bytes': self._bytes
+        }
+
+
+class RedisCache:
+    """Cache distribué Redis, partagé entre les workers (niveau L2)"""
+    
+    def __init__(self, url: str, prefix: str = "tw3:", default_ttl: float = 3600):
+        import redis  # dépendance optionnelle
+        import redis.asyncio
+        
+        self._redis_error = redis.RedisError
+        # Client asynchrone : un Redis lent ou absent ne bloque pas la boucle d'événements
+        self._client = redis.asyncio.Redis.from_url(url, socket_timeout=0.5, decode_responses=True)
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'errors': 0
+        }
+    
+    async def get(self, key: Union[str, dict, list]) -> Optional[Any]:
+        """Récupère une valeur (None si absente ou si Redis est indisponible)"""
+        try:
+            raw = await self._client.get(self.prefix + InMemoryCache._make_key(key))
+        except self._redis_error as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Redis indisponible (get): {e}")
+            return None
+        
+        if raw is None:
+            self._stats['misses'] += 1
+            return None
+        
+        self._stats['hits'] += 1
+        return _json_loads(raw)
+    
+    async def set(self, key: Union[str, dict, list], value: Any, ttl: Optional[float] = None):
+        """Stocke une valeur sérialisée en JSON avec expiration"""
+        try:
+            await self._client.setex(
+                self.prefix + InMemoryCache._make_key(key),
+                int(ttl or self.default_ttl),
+                _json_dumps(value)
+            )
+        except self._redis_error as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Redis indisponible (set): {e}")
+    
+    async def delete(self, key: Union[str, dict, list]):
+        """Supprime une valeur (ignoré si Redis est indisponible)"""
+        try:
+            await self._client.delete(self.prefix + InMemoryCache._make_key(key))
+        except self._redis_error as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Redis indisponible (delete): {e}")
+    
+    async def close(self):
+        """Ferme le pool de connexions Redis"""
+        await self._client.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Retourne les statistiques du cache"""
+        total_requests = self._stats['hits'] + self._stats['misses']
+        hit_rate = self._stats['hits'] / total_requests if total_requests > 0 else 0
+        
+        return {
+            **self._stats,
+            'hit_rate': hit_rate
         }
 
 
 class NewsCache:
-    """Cache spécialisé pour les actualités"""
+    """Cache spécialisé pour les actualités (L1 en mémoire + L2 Redis optionnel)"""
     
-    def __init__(self):
-        self.cache = InMemoryCache(max_size=500, default_ttl=1800)  # 30 minutes
+    # Filet de sécurité : la fraîcheur est assurée par l'invalidation active
+    NEWS_TTL = 3600  # 1 heure pour les news
     
-    def get_news(self, query: str, from_date: str, sort: str, max_results: int) -> Optional[str]:
-        """Récupère les actualités du cache"""
-        cache_key = {
+    def __init__(self, l2: Optional[RedisCache] = None):
+        self.l2 = l2
+        # Index requête normalisée -> clés en cache, et popularité des requêtes
+        self._keys_by_query: Dict[str, set] = {}
+        self._query_hits: Dict[str, int] = {}
+        if l2 is None:
+            self.cache = InMemoryCache(max_size=500, default_ttl=self.NEWS_TTL)
+            self._l1_ttl = self.NEWS_TTL
+        else:
+            # Avec un L2 partagé, le L1 ne garde que les requêtes les plus chaudes
+            self.cache = InMemoryCache(max_size=64, default_ttl=60)
+            self._l1_ttl = 60
+    
+    @staticmethod
+    def _news_key(query: str, from_date: str, sort: str, max_results: int) -> str:
+        """Clé normalisée d'une recherche d'actualités, hachée une seule fois"""
+        return InMemoryCache._make_key({
             'query': query.lower().strip(),
             'from_date': from_date,
             'sort': sort,
             'max_results': max_results
-        }
+        })
+    
+    async def get_news(self, query: str, from_date: str, sort: str, max_results: int) -> Optional[Any]:
+        """Récupère les actualités du cache (L1 puis L2)"""
+        query_key = query.lower().strip()
+        cache_key = self._news_key(query, from_date, sort, max_results)
         
-        return self.cache.get(cache_key)
+        news_content = self.cache.get(cache_key)
+        if news_content is None and self.l2 is not None:
+            news_content = await self.l2.get(cache_key)
+            if news_content is not None:
+                # Promotion dans le L1 pour les prochains appels de ce worker
+                self.cache.set(cache_key, news_content, self._l1_ttl)
+                self._index(query_key, cache_key)
+        
+        if news_content is not None:
+            self._query_hits[query_key] = self._query_hits.get(query_key, 0) + 1
+        return news_content
     
-    def set_news(self, query: str, from_date: str, sort: str, max_results: int, news_content: str):
-        """Stocke les actualités dans le cache"""
-        cache_key = {
-            'query': query.lower().strip(),
-            'from_date': from_date,
-            'sort': sort,
-            'max_results': max_results
-        }
+    async def set_news(self, query: str, from_date: str, sort: str, max_results: int, news_content: Any):
+        """Stocke les actualités dans les deux niveaux de cache"""
+        cache_key = self._news_key(query, from_date, sort, max_results)
+        
+        self.cache.set(cache_key, news_content, self._l1_ttl)
+        if self.l2 is not None:
+            await self.l2.set(cache_key, news_content, self.NEWS_TTL)
+        self._index(query.lower().strip(), cache_key)
+    
+    def _index(self, query_key: str, cache_key: str):
+        """Rattache une clé à sa requête (index borné à la taille du L1)"""
+        keys = self._keys_by_query.pop(query_key, set())
+        keys.add(cache_key)
+        self._keys_by_query[query_key] = keys  # réinsertion : requête la plus récente
+        if len(self._keys_by_query) > self.cache.max_size:
+            oldest = next(iter(self._keys_by_query))
+            del self._keys_by_query[oldest]
+            self._query_hits.pop(oldest, None)
+    
+    def hot_queries(self, limit: int) -> list:
+        """Requêtes en cache les plus sollicitées (candidates à la sonde de fraîcheur)"""
+        return sorted(
+            self._keys_by_query,
+            key=lambda q: self._query_hits.get(q, 0),
+            reverse=True
+        )[:limit]
+    
+    async def invalidate_query(self, query: str) -> int:
+        """
+        Invalide toutes les entrées d'une requête, quelles que soient ses dates.
+        
+        Toute fenêtre `from_date` se termine à « maintenant » : un nouvel article
+        concerne donc toutes les variantes en cache de la requête.
         
-        # TTL plus court pour les actualités récentes
-        ttl = 900  # 15 minutes pour les news
-        self.cache.set(cache_key, news_content, ttl)
+        Returns:
+            int: Nombre de clés invalidées
+        """
+        query_key = query.lower().strip()
+        keys = self._keys_by_query.pop(query_key, set())
+        self._query_hits.pop(query_key, None)
+        for key in keys:
+            self.cache.delete(key)
+            if self.l2 is not None:
+                await self.l2.delete(key)
+        return len(keys)
 
 
 class ModelCache:
@@ -157,33 +352,83 @@ class ModelCache:
     def __init__(self):
         self.cache = InMemoryCache(max_size=200, default_ttl=7200)  # 2 heures
     
-    def get_response(self, prompt: str) -> Optional[str]:
-        """Récupère une réponse du cache"""
-        # Hash du prompt pour la clé
-        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
-        return self.cache.get(prompt_hash)
+    @staticmethod
+    def make_key(prompt: str, max_new_tokens: int, temperature: float) -> str:
+        """Clé compacte : empreinte du prompt + paramètres de génération"""
+        prompt_hash = _digest(prompt.encode())
+        return f"{prompt_hash}:{max_new_tokens}:{temperature}"
+    
+    def get_response(self, cache_key: str) -> Optional[str]:
+        """Récupère une réponse du cache à partir d'une clé `make_key`"""
+        return self.cache.get(cache_key)
+    
+    def set_response(self, cache_key: str, response: str):
+        """Stocke une réponse dans le cache sous une clé `make_key`"""
+        self.cache.set(cache_key, response)
+
+
+class AnswerCache:
+    """Cache des réponses finales de /ask, court-circuitant prompt et génération"""
+    
+    def __init__(self):
+        # Une réponse n'est pas plus fraîche que les actualités qui l'ont produite
+        self.cache = InMemoryCache(max_size=200, default_ttl=NewsCache.NEWS_TTL)
+        self._keys_by_query: Dict[str, set] = {}
+    
+    @staticmethod
+    def make_key(question: str, news_ctx: str, max_new_tokens: int = 0) -> str:
+        """Empreinte de la question, du contexte d'actualités et du budget de tokens"""
+        return _digest(f"{max_new_tokens}||{question}||".encode() + news_ctx.encode())
+    
+    def get_answer(self, cache_key: str) -> Optional[str]:
+        """Récupère une réponse à partir d'une clé `make_key`"""
+        return self.cache.get(cache_key)
     
-    def set_response(self, prompt: str, response: str):
-        """Stocke une réponse dans le cache"""
-        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
-        self.cache.set(prompt_hash, response)
+    def set_answer(self, news_query: str, cache_key: str, answer: str):
+        """Stocke une réponse, rattachée à la requête d'actualités qui l'a nourrie"""
+        self.cache.set(cache_key, answer)
+        query_key = news_query.lower().strip()
+        self._keys_by_query.setdefault(query_key, set()).add(cache_key)
+        if len(self._keys_by_query) > self.cache.max_size:
+            del self._keys_by_query[next(iter(self._keys_by_query))]
+    
+    def invalidate_query(self, news_query: str) -> int:
+        """Invalide les réponses construites sur les actualités d'une requête"""
+        keys = self._keys_by_query.pop(news_query.lower().strip(), set())
+        for key in keys:
+            self.cache.delete(key)
+        return len(keys)
 
 
 class CacheManager:
     """Gestionnaire centralisé des caches"""
     
     def __init__(self):
-        self.news_cache = NewsCache()
+        self.news_cache = NewsCache(l2=self._connect_l2())
         self.model_cache = ModelCache()
+        self.answer_cache = AnswerCache()
         self._cleanup_task: Optional[asyncio.Task] = None
     
+    @staticmethod
+    def _connect_l2() -> Optional[RedisCache]:
+        """Crée le cache L2 Redis si `REDIS_URL` est défini"""
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            return None
+        
+        try:
+            return RedisCache(redis_url, prefix="tw3:news:")
+        except ImportError:
+            logger.warning("REDIS_URL défini mais le paquet redis est absent, cache L1 seul")
+            return None
+    
     async def start_cleanup_task(self):
         """Démarre la tâche de nettoyage périodique"""
         if self._cleanup_task is None:
             self._cleanup_task = asyncio.create_task(self._periodic_cleanup())
     
     async def stop_cleanup_task(self):
-        """Arrête la tâche de nettoyage"""
+        """Arrête la tâche de nettoyage et ferme la connexion au L2"""
         if self._cleanup_task:
             self._cleanup_task.cancel()
             try:
@@ -191,6 +436,8 @@ class CacheManager:
             except asyncio.CancelledError:
                 pass
             self._cleanup_task = None
+        if self.news_cache.l2 is not None:
+            await self.news_cache.l2.close()
     
     async def _periodic_cleanup(self):
         """Nettoyage périodique des caches expirés"""
@@ -201,6 +448,7 @@ class CacheManager:
                 # Nettoyage des entrées expirées
                 self._cleanup_expired_entries(self.news_cache.cache)
                 self._cleanup_expired_entries(self.model_cache.cache)
+                self._cleanup_expired_entries(self.answer_cache.cache)
                 
                 logger.debug("Cache cleanup completed")
                 
@@ -211,32 +459,28 @@ class CacheManager:
     
     def _cleanup_expired_entries(self, cache: InMemoryCache):
         """Nettoie les entrées expirées d'un cache"""
-        expired_keys = [
-            key for key, entry in cache._cache.items()
-            if entry.is_expired
-        ]
-        
-        for key in expired_keys:
-            del cache._cache[key]
-        
-        if expired_keys:
-            logger.debug(f"Supprimé {len(expired_keys)} entrées expirées")
+        removed = cache.purge_expired()
+        if removed:
+            logger.debug(f"Supprimé {removed} entrées expirées")
     
     def get_global_stats(self) -> Dict[str, Any]:
         """Retourne les statistiques globales des caches"""
-        return {
+        stats = {
             'news_cache': self.news_cache.cache.get_stats(),
             'model_cache': self.model_cache.cache.get_stats(),
+            'answer_cache': self.answer_cache.cache.get_stats(),
             'total_memory_usage': self._estimate_memory_usage()
         }
+        if self.news_cache.l2 is not None:
+            stats['news_cache_l2'] = self.news_cache.l2.get_stats()
+        return stats
     
     def _estimate_memory_usage(self) -> str:
-        """Estime l'utilisation mémoire des caches"""
-        # Estimation approximative
-        news_size = len(self.news_cache.cache._cache) * 2048  # ~2KB par news
-        model_size = len(self.model_cache.cache._cache) * 4096  # ~4KB par réponse
-        
-        total_bytes = news_size + model_size
+        """Utilisation mémoire des caches L1, tenue à jour à chaque écriture"""
+        total_bytes = sum(
+            cache._bytes for cache in
+            (self.news_cache.cache, self.model_cache.cache, self.answer_cache.cache)
+        )
         
         if total_bytes < 1024:
             return f"{total_bytes} B"
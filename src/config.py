@@ -3,12 +3,13 @@
 import os
 from typing import Optional
 from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-@dataclass
+@dataclass(frozen=True)
 class NewsAPIConfig:
     """Configuration pour NewsAPI"""
     api_key: str
@@ -25,7 +26,7 @@ class NewsAPIConfig:
         return cls(api_key=api_key)
 
 
-@dataclass  
+@dataclass(frozen=True)
 class ModelConfig:
     """Configuration pour le modèle Qwen"""
     model_name: str = "Qwen/Qwen2.5-Coder-7B-Instruct"
@@ -35,7 +36,7 @@ class ModelConfig:
     trust_remote_code: bool = True
 
 
-@dataclass
+@dataclass(frozen=True)
 class LoggingConfig:
     """Configuration pour les logs"""
     log_dir: str = "/app/volume/conversations"
@@ -44,7 +45,7 @@ class LoggingConfig:
     retention_days: int = 90
 
 
-@dataclass
+@dataclass(frozen=True)
 class ResilienceConfig:
     """Configuration pour la resilience"""
     circuit_breaker_threshold: int = 5
@@ -54,19 +55,15 @@ class ResilienceConfig:
     rate_limit_calls_per_hour: int = 100
 
 
-@dataclass
+@dataclass(frozen=True)
 class SecurityConfig:
     """Configuration pour la sécurité"""
-    cors_origins: list = None
+    cors_origins: tuple[str, ...] = ("*",)  # À restreindre en production
     api_key_header: str = "X-API-Key"
     max_request_size: int = 1024 * 1024  # 1MB
-    
-    def __post_init__(self):
-        if self.cors_origins is None:
-            self.cors_origins = ["*"]  # À restreindre en production
 
 
-@dataclass
+@dataclass(frozen=True)
 class AppConfig:
     """Configuration principale de l'application"""
     news_api: NewsAPIConfig
@@ -95,5 +92,11 @@ class AppConfig:
         )
 
 
-# Instance globale de configuration
-config = AppConfig.load()
+@lru_cache(maxsize=1)
+def get_config() -> AppConfig:
+    """Configuration globale, chargée au premier appel puis partagée.
+    
+    Les tests modifient l'environnement puis appellent `get_config.cache_clear()`
+    au lieu de recharger le module.
+    """
+    return AppConfig.load()
@@ -1,16 +1,38 @@
 """Module de monitoring et health checks pour TW3"""
 
 import asyncio
+import functools
+import os
 import time
 import psutil
 import logging
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, asdict
-from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Optional, List
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson  # dépendance optionnelle : (dé)sérialisation JSON plus rapide
+    
+    _json_loads = orjson.loads
+    
+    def _json_dumps_indent(data: Any) -> str:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    import json
+    
+    _json_loads = json.loads
+    
+    def _json_dumps_indent(data: Any) -> str:
+        return json.dumps(data, indent=2)
+
+# Durée (s) pendant laquelle un rapport de santé complet est resservi tel quel
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "10"))
+# Durée (s) de mémorisation de chaque métrique système (psutil)
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "5"))
+
 
 class HealthStatus(Enum):
     """États de santé des services"""
@@ -31,18 +53,40 @@ class ServiceHealth:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convertit en dictionnaire pour JSON"""
-        result = asdict(self)
-        result['status'] = self.status.value
-        if self.last_check:
-            result['last_check'] = self.last_check.isoformat()
-        return result
+        # Construction directe : `asdict` recopie récursivement chaque champ
+        return {
+            'name': self.name,
+            'status': self.status.value,
+            'response_time_ms': self.response_time_ms,
+            'error_message': self.error_message,
+            'last_check': self.last_check.isoformat() if self.last_check else None,
+            'metadata': self.metadata,
+        }
+
+
+def _ttl_cached(func: Callable) -> Callable:
+    """Mémorise le résultat d'une méthode de classe pendant `METRICS_CACHE_TTL` secondes"""
+    @functools.wraps(func)
+    def wrapper(cls):
+        now = time.monotonic()
+        hit = cls._cache.get(func.__name__)
+        if hit is not None and now - hit[0] < METRICS_CACHE_TTL:
+            return hit[1]
+        value = func(cls)
+        cls._cache[func.__name__] = (now, value)
+        return value
+    return wrapper
 
 
 class SystemMetrics:
     """Collecteur de métriques système"""
     
-    @staticmethod
-    def get_memory_usage() -> Dict[str, float]:
+    # Dernière mesure de chaque métrique : nom de méthode -> (horodatage monotone, valeur)
+    _cache: Dict[str, tuple] = {}
+    
+    @classmethod
+    @_ttl_cached
+    def get_memory_usage(cls) -> Dict[str, float]:
         """Retourne l'utilisation mémoire"""
         memory = psutil.virtual_memory()
         return {
@@ -52,17 +96,20 @@ class SystemMetrics:
             'percentage': memory.percent
         }
     
-    @staticmethod
-    def get_cpu_usage() -> Dict[str, float]:
+    @classmethod
+    @_ttl_cached
+    def get_cpu_usage(cls) -> Dict[str, float]:
         """Retourne l'utilisation CPU"""
         return {
-            'percentage': psutil.cpu_percent(interval=1),
+            # Non bloquant : utilisation moyenne depuis l'appel précédent
+            'percentage': psutil.cpu_percent(interval=None),
             'count': psutil.cpu_count(),
             'load_avg': psutil.getloadavg() if hasattr(psutil, 'getloadavg') else [0, 0, 0]
         }
     
-    @staticmethod
-    def get_disk_usage() -> Dict[str, float]:
+    @classmethod
+    @_ttl_cached
+    def get_disk_usage(cls) -> Dict[str, float]:
         """Retourne l'utilisation disque"""
         disk = psutil.disk_usage('/')
         return {
@@ -73,19 +120,46 @@ class SystemMetrics:
         }
 
 
-class NewsAPIHealthChecker:
+# Amorce les compteurs CPU : le premier appel non bloquant renvoie toujours 0.0
+psutil.cpu_percent(interval=None)
+
+
+class _HTTPHealthChecker:
+    """Base des vérificateurs HTTP : une session aiohttp persistante par vérificateur"""
+    
+    _session = None
+    
+    def _get_session(self):
+        """Session créée au premier appel ; connexions TCP/TLS conservées entre sondes"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+        return self._session
+    
+    async def aclose(self):
+        """Ferme la session HTTP (arrêt de l'application)"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class NewsAPIHealthChecker(_HTTPHealthChecker):
     """Vérificateur de santé pour NewsAPI"""
     
     def __init__(self, api_key: str):
         self.api_key = api_key
     
-    async def check_health(self) -> ServiceHealth:
+    async def check_health(self, now: Optional[datetime] = None) -> ServiceHealth:
         """Vérifie la santé de NewsAPI"""
         start_time = time.time()
+        # Horodatage unique de la vérification (fourni par le rapport complet)
+        now = now or datetime.now(timezone.utc)
         
         try:
-            import aiohttp
-            
             # Test simple avec une requête légère
             url = "https://newsapi.org/v2/top-headlines"
             params = {
@@ -94,62 +168,61 @@ class NewsAPIHealthChecker:
                 'apiKey': self.api_key
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    response_time = (time.time() - start_time) * 1000
+            async with self._get_session().get(url, params=params) as response:
+                response_time = (time.time() - start_time) * 1000
+                
+                # NewsAPI signale ses erreurs (clé, quota…) par le code HTTP : le
+                # statut suffit. Le corps (un article) est lu sans être analysé,
+                # pour que la connexion reste réutilisable.
+                await response.read()
+                if response.status == 200:
+                    return ServiceHealth(
+                        name="NewsAPI",
+                        status=HealthStatus.HEALTHY,
+                        response_time_ms=response_time,
+                        last_check=now
+                    )
+                else:
+                    return ServiceHealth(
+                        name="NewsAPI",
+                        status=HealthStatus.UNHEALTHY,
+                        response_time_ms=response_time,
+                        error_message=f"HTTP {response.status}",
+                        last_check=now
+                    )
                     
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('status') == 'ok':
-                            return ServiceHealth(
-                                name="NewsAPI",
-                                status=HealthStatus.HEALTHY,
-                                response_time_ms=response_time,
-                                last_check=datetime.now(timezone.utc),
-                                metadata={'articles_available': len(data.get('articles', []))}
-                            )
-                        else:
-                            return ServiceHealth(
-                                name="NewsAPI",
-                                status=HealthStatus.DEGRADED,
-                                response_time_ms=response_time,
-                                error_message=data.get('message', 'Unknown API error'),
-                                last_check=datetime.now(timezone.utc)
-                            )
-                    else:
-                        return ServiceHealth(
-                            name="NewsAPI",
-                            status=HealthStatus.UNHEALTHY,
-                            response_time_ms=response_time,
-                            error_message=f"HTTP {response.status}",
-                            last_check=datetime.now(timezone.utc)
-                        )
-                        
         except asyncio.TimeoutError:
             return ServiceHealth(
                 name="NewsAPI",
                 status=HealthStatus.UNHEALTHY,
                 error_message="Timeout après 10 secondes",
-                last_check=datetime.now(timezone.utc)
+                last_check=now
             )
         except Exception as e:
             return ServiceHealth(
                 name="NewsAPI",
                 status=HealthStatus.UNHEALTHY,
                 error_message=str(e),
-                last_check=datetime.now(timezone.utc)
+                last_check=now
             )
 
 
 class ModelHealthChecker:
-    """Vérificateur de santé pour le modèle Qwen"""
+    """
+    Vérificateur de santé pour le modèle Qwen.
+    
+    `get_pipe_func` doit renvoyer un appelable non bloquant : il est appelé
+    sur la boucle d'événements, en parallèle des autres sondes du rapport.
+    """
     
     def __init__(self, get_pipe_func):
         self.get_pipe_func = get_pipe_func
     
-    async def check_health(self) -> ServiceHealth:
+    async def check_health(self, now: Optional[datetime] = None) -> ServiceHealth:
         """Vérifie la santé du modèle"""
         start_time = time.time()
+        # Horodatage unique de la vérification (fourni par le rapport complet)
+        now = now or datetime.now(timezone.utc)
         
         try:
             # Test simple de génération
@@ -173,7 +246,7 @@ class ModelHealthChecker:
                     name="QwenModel",
                     status=HealthStatus.HEALTHY,
                     response_time_ms=response_time,
-                    last_check=datetime.now(timezone.utc),
+                    last_check=now,
                     metadata={'test_generation': 'success'}
                 )
             else:
@@ -182,7 +255,54 @@ class ModelHealthChecker:
                     status=HealthStatus.DEGRADED,
                     response_time_ms=response_time,
                     error_message="Empty model response",
-                    last_check=datetime.now(timezone.utc)
+                    last_check=now
+                )
+                
+        except Exception as e:
+            response_time = (time.time() - start_time) * 1000
+            return ServiceHealth(
+                name="QwenModel",
+                status=HealthStatus.UNHEALTHY,
+                response_time_ms=response_time,
+                error_message=str(e),
+                last_check=now
+            )
+
+
+class RemoteModelHealthChecker(_HTTPHealthChecker):
+    """Vérificateur de santé pour un serveur vLLM (API compatible OpenAI)"""
+    
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+    
+    async def check_health(self, now: Optional[datetime] = None) -> ServiceHealth:
+        """Vérifie que le serveur répond et expose au moins un modèle"""
+        start_time = time.time()
+        # Horodatage unique de la vérification (fourni par le rapport complet)
+        now = now or datetime.now(timezone.utc)
+        
+        try:
+            # Liste des modèles servis : requête légère, sans génération
+            async with self._get_session().get(f"{self.base_url}/models") as response:
+                response_time = (time.time() - start_time) * 1000
+                
+                if response.status == 200:
+                    data = await response.json(loads=_json_loads)
+                    models = [m.get('id') for m in data.get('data', [])]
+                    return ServiceHealth(
+                        name="QwenModel",
+                        status=HealthStatus.HEALTHY if models else HealthStatus.DEGRADED,
+                        response_time_ms=response_time,
+                        error_message=None if models else "Aucun modèle servi",
+                        last_check=now,
+                        metadata={'backend': 'vllm', 'models': models}
+                    )
+                return ServiceHealth(
+                    name="QwenModel",
+                    status=HealthStatus.UNHEALTHY,
+                    response_time_ms=response_time,
+                    error_message=f"HTTP {response.status}",
+                    last_check=now
                 )
                 
         except Exception as e:
@@ -192,44 +312,78 @@ class ModelHealthChecker:
                 status=HealthStatus.UNHEALTHY,
                 response_time_ms=response_time,
                 error_message=str(e),
-                last_check=datetime.now(timezone.utc)
+                last_check=now
             )
 
 
 class HealthCheckManager:
     """Gestionnaire centralisé des health checks"""
     
-    def __init__(self, api_key: str, get_pipe_func):
+    def __init__(self, api_key: str, get_pipe_func, model_base_url: Optional[str] = None):
         self.news_checker = NewsAPIHealthChecker(api_key)
-        self.model_checker = ModelHealthChecker(get_pipe_func)
+        # Modèle servi par vLLM : sonde HTTP plutôt qu'une génération locale
+        if model_base_url:
+            self.model_checker = RemoteModelHealthChecker(model_base_url)
+        else:
+            self.model_checker = ModelHealthChecker(get_pipe_func)
         self.system_metrics = SystemMetrics()
         
         # Cache des dernières vérifications
         self._last_checks: Dict[str, ServiceHealth] = {}
         self._check_interval = 300  # 5 minutes (au lieu de 1 minute)
+        # Une seule sonde en cours par service quand le cache est périmé
+        self._locks = {'newsapi': asyncio.Lock(), 'model': asyncio.Lock()}
         self._background_task: Optional[asyncio.Task] = None
         
         # Historique des succès pour optimiser les health checks
         self._last_successful_use: Dict[str, datetime] = {}
+        
+        # Dernier rapport complet et calcul en cours, partagé par les appelants concurrents
+        self._cached_report: Optional[Dict[str, Any]] = None
+        self._cache_ts = 0.0
+        self._inflight: Optional[asyncio.Future] = None
     
     async def get_full_health_report(self) -> Dict[str, Any]:
-        """Retourne un rapport de santé complet"""
+        """Retourne un rapport de santé complet
         
-        # Vérifications des services
-        news_health = await self.news_checker.check_health()
-        model_health = await self.model_checker.check_health()
+        Le rapport est resservi pendant `HEALTH_CACHE_TTL` secondes ; au-delà, un
+        seul calcul est lancé et attendu par tous les appelants concurrents.
+        """
+        if self._cached_report is not None and time.monotonic() - self._cache_ts < HEALTH_CACHE_TTL:
+            return self._cached_report
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._compute_report())
+            self._inflight.add_done_callback(self._store_report)
+        # shield : un client qui abandonne n'annule pas le calcul des autres
+        return await asyncio.shield(self._inflight)
+    
+    def _store_report(self, future: asyncio.Future):
+        """Met en cache le rapport calculé (les échecs ne sont pas mis en cache)"""
+        self._inflight = None
+        if not future.cancelled() and future.exception() is None:
+            self._cached_report = future.result()
+            self._cache_ts = time.monotonic()
+    
+    async def _compute_report(self) -> Dict[str, Any]:
+        """Exécute les vérifications et collecte les métriques du rapport"""
         
-        # Métriques système
-        memory = self.system_metrics.get_memory_usage()
-        cpu = self.system_metrics.get_cpu_usage()
-        disk = self.system_metrics.get_disk_usage()
+        # Sondes des services et métriques système en parallèle ; les appels
+        # psutil (appels système) tournent dans des threads, hors de la boucle
+        now = datetime.now(timezone.utc)
+        news_health, model_health, memory, cpu, disk = await asyncio.gather(
+            self._get_or_check('newsapi', self.news_checker, now),
+            self._get_or_check('model', self.model_checker, now),
+            asyncio.to_thread(self.system_metrics.get_memory_usage),
+            asyncio.to_thread(self.system_metrics.get_cpu_usage),
+            asyncio.to_thread(self.system_metrics.get_disk_usage),
+        )
         
         # État global
         overall_status = self._determine_overall_status([news_health, model_health], memory, cpu)
         
         return {
             'status': overall_status.value,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'timestamp': now.isoformat(),
             'version': '1.0.0',
             'services': {
                 'newsapi': news_health.to_dict(),
@@ -243,6 +397,26 @@ class HealthCheckManager:
             'cache_stats': self._get_cache_stats()
         }
     
+    async def _get_or_check(self, service_name: str, checker, now: datetime) -> ServiceHealth:
+        """Dernier état connu s'il date de moins de `_check_interval`, sinon nouvelle sonde"""
+        max_age = timedelta(seconds=self._check_interval)
+        cached = self._last_checks.get(service_name)
+        if cached is not None and cached.last_check and now - cached.last_check < max_age:
+            return cached
+        async with self._locks[service_name]:
+            # Une sonde concurrente a pu rafraîchir le cache pendant l'attente du verrou
+            cached = self._last_checks.get(service_name)
+            if cached is not None and cached.last_check and now - cached.last_check < max_age:
+                return cached
+            health = await checker.check_health(now)
+            self._last_checks[service_name] = health
+            return health
+    
+    async def check_service_health(self, service_name: str) -> ServiceHealth:
+        """Vérifie un service ('newsapi' ou 'model'), en réutilisant un état récent"""
+        checker = self.news_checker if service_name == 'newsapi' else self.model_checker
+        return await self._get_or_check(service_name, checker, datetime.now(timezone.utc))
+    
     def _determine_overall_status(
         self, 
         service_healths: List[ServiceHealth], 
@@ -252,16 +426,15 @@ class HealthCheckManager:
         """Détermine l'état global du système"""
         
         # Vérification des services critiques
-        unhealthy_services = [s for s in service_healths if s.status == HealthStatus.UNHEALTHY]
-        if unhealthy_services:
+        if any(s.status is HealthStatus.UNHEALTHY for s in service_healths):
             return HealthStatus.UNHEALTHY
         
-        degraded_services = [s for s in service_healths if s.status == HealthStatus.DEGRADED]
+        has_degraded = any(s.status is HealthStatus.DEGRADED for s in service_healths)
         
         # Vérification des ressources système
         if memory['percentage'] > 95 or cpu['percentage'] > 95:
             return HealthStatus.UNHEALTHY
-        elif memory['percentage'] > 85 or cpu['percentage'] > 85 or degraded_services:
+        elif memory['percentage'] > 85 or cpu['percentage'] > 85 or has_degraded:
             return HealthStatus.DEGRADED
         
         return HealthStatus.HEALTHY
@@ -280,7 +453,7 @@ class HealthCheckManager:
             self._background_task = asyncio.create_task(self._background_health_checks())
     
     async def stop_background_checks(self):
-        """Arrête les vérifications en arrière-plan"""
+        """Arrête les vérifications en arrière-plan et ferme les sessions HTTP"""
         if self._background_task:
             self._background_task.cancel()
             try:
@@ -288,6 +461,10 @@ class HealthCheckManager:
             except asyncio.CancelledError:
                 pass
             self._background_task = None
+        # Sessions HTTP persistantes des sondes
+        for checker in (self.news_checker, self.model_checker):
+            if isinstance(checker, _HTTPHealthChecker):
+                await checker.aclose()
     
     async def _background_health_checks(self):
         """Vérifications périodiques en arrière-plan"""
@@ -332,14 +509,15 @@ class HealthCheckManager:
     
     def mark_service_success(self, service_name: str):
         """Marque qu'un service a été utilisé avec succès"""
-        self._last_successful_use[service_name] = datetime.now(timezone.utc)
+        now = datetime.now(timezone.utc)
+        self._last_successful_use[service_name] = now
         
         # Met à jour le cache avec un état healthy
         if service_name == "newsapi":
             self._last_checks[service_name] = ServiceHealth(
                 name="NewsAPI",
                 status=HealthStatus.HEALTHY,
-                last_check=datetime.now(timezone.utc),
+                last_check=now,
                 metadata={'source': 'real_usage'}
             )
     
@@ -356,8 +534,6 @@ class HealthCheckManager:
 def main():
     """Point d'entrée CLI pour les health checks"""
     import argparse
-    import json
-    import os
     
     parser = argparse.ArgumentParser(description="TW3 Health Check Tool")
     parser.add_argument("--service", choices=["newsapi", "model", "all"], 
@@ -367,31 +543,42 @@ def main():
     
     args = parser.parse_args()
     
+    try:
+        from uvloop import run  # boucle libuv, comme le serveur (uvicorn --loop uvloop)
+    except ImportError:
+        from asyncio import run
+    
     # Configuration de base
     api_key = os.getenv("NEWSAPI_KEY")
     if not api_key:
         print("ERROR: NEWSAPI_KEY not configured")
         return 1
     
+    services = ["newsapi", "model"] if args.service == "all" else [args.service]
+    
+    async def check_services() -> Dict[str, Any]:
+        """Vérifie les services demandés dans une seule boucle, puis ferme les sessions HTTP"""
+        try:
+            healths = await asyncio.gather(
+                *(health_manager.check_service_health(service) for service in services),
+                return_exceptions=True
+            )
+        finally:
+            await health_manager.stop_background_checks()
+        return {
+            service: {"status": "unhealthy", "error_message": str(health)}
+            if isinstance(health, Exception) else health.to_dict()
+            for service, health in zip(services, healths)
+        }
+    
     # Création du health manager
     try:
         health_manager = HealthCheckManager(api_key, lambda: None)
-        
-        if args.service == "all":
-            results = {}
-            for service in ["newsapi", "model"]:
-                try:
-                    health = asyncio.run(health_manager.check_service_health(service))
-                    results[service] = health.to_dict()
-                except Exception as e:
-                    results[service] = {"status": "unhealthy", "error": str(e)}
-        else:
-            health = asyncio.run(health_manager.check_service_health(args.service))
-            results = {args.service: health.to_dict()}
+        results = run(check_services())
         
         # Affichage
         if args.format == "json":
-            print(json.dumps(results, indent=2))
+            print(_json_dumps_indent(results))
         else:
             for service, health in results.items():
                 status = health.get("status", "unknown")
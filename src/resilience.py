@@ -1,9 +1,12 @@
 """Module de gestion des erreurs et resilience pour TW3"""
 
+import asyncio
 import functools
+import random
+import threading
 import time
 import logging
-from typing import Any, Callable, Optional
+from typing import Any, Callable
 from enum import Enum
 
 logger = logging.getLogger(__name__)
@@ -30,24 +33,42 @@ class CircuitBreaker:
         self.expected_exception = expected_exception
         
         self.failure_count = 0
-        self.last_failure_time: Optional[float] = None
+        # Horloge monotone en nanosecondes (0 : aucun échec) : insensible aux sauts NTP
+        self.last_failure_time_ns = 0
+        self.recovery_timeout_ns = int(recovery_timeout * 1_000_000_000)
         self.state = CircuitBreakerState.CLOSED
+        # Protège les transitions d'état (boucle d'événements + threads d'exécuteur)
+        self._lock = threading.Lock()
     
     def __call__(self, func: Callable) -> Callable:
-        """Décorateur pour appliquer le circuit breaker"""
+        """Décorateur pour appliquer le circuit breaker (sync ou coroutine)"""
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self._acall(func, *args, **kwargs)
+            return async_wrapper
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             return self._call(func, *args, **kwargs)
         return wrapper
     
+    def _before_call(self):
+        """Vérifie l'état du circuit avant d'autoriser un appel"""
+        # Chemin nominal (CLOSED) sans verrou : la lecture d'un attribut est atomique
+        if self.state is CircuitBreakerState.CLOSED:
+            return
+        with self._lock:
+            if self.state is CircuitBreakerState.OPEN:
+                if self._should_attempt_reset():
+                    self.state = CircuitBreakerState.HALF_OPEN
+                    logger.info("Circuit breaker: tentative de reset (HALF_OPEN)")
+                else:
+                    raise Exception("Circuit breaker OPEN - service indisponible")
+    
     def _call(self, func: Callable, *args, **kwargs) -> Any:
         """Exécute la fonction avec protection circuit breaker"""
-        if self.state == CircuitBreakerState.OPEN:
-            if self._should_attempt_reset():
-                self.state = CircuitBreakerState.HALF_OPEN
-                logger.info("Circuit breaker: tentative de reset (HALF_OPEN)")
-            else:
-                raise Exception("Circuit breaker OPEN - service indisponible")
+        self._before_call()
         
         try:
             result = func(*args, **kwargs)
@@ -57,30 +78,46 @@ class CircuitBreaker:
             self._on_failure()
             raise e
     
+    async def _acall(self, func: Callable, *args, **kwargs) -> Any:
+        """Exécute la coroutine avec protection circuit breaker"""
+        self._before_call()
+        
+        try:
+            result = await func(*args, **kwargs)
+            self._on_success()
+            return result
+        except self.expected_exception as e:
+            self._on_failure()
+            raise e
+    
     def _should_attempt_reset(self) -> bool:
         """Vérifie si on doit tenter de remettre le circuit en service"""
         return (
-            self.last_failure_time is not None and
-            time.time() - self.last_failure_time >= self.recovery_timeout
+            self.last_failure_time_ns != 0 and
+            time.monotonic_ns() - self.last_failure_time_ns >= self.recovery_timeout_ns
         )
     
     def _on_success(self):
         """Réinitialise le circuit breaker en cas de succès"""
-        self.failure_count = 0
-        self.state = CircuitBreakerState.CLOSED
-        if self.state == CircuitBreakerState.HALF_OPEN:
-            logger.info("Circuit breaker: reset réussi (CLOSED)")
+        if self.state is CircuitBreakerState.CLOSED and self.failure_count == 0:
+            return
+        with self._lock:
+            if self.state is CircuitBreakerState.HALF_OPEN:
+                logger.info("Circuit breaker: reset réussi (CLOSED)")
+            self.failure_count = 0
+            self.state = CircuitBreakerState.CLOSED
     
     def _on_failure(self):
         """Gère les échecs et ouvre le circuit si nécessaire"""
-        self.failure_count += 1
-        self.last_failure_time = time.time()
-        
-        if self.failure_count >= self.failure_threshold:
-            self.state = CircuitBreakerState.OPEN
-            logger.warning(
-                f"Circuit breaker: OUVERT après {self.failure_count} échecs"
-            )
+        with self._lock:
+            self.failure_count += 1
+            self.last_failure_time_ns = time.monotonic_ns()
+            
+            if self.failure_count >= self.failure_threshold:
+                self.state = CircuitBreakerState.OPEN
+                logger.warning(
+                    f"Circuit breaker: OUVERT après {self.failure_count} échecs"
+                )
 
 
 def retry_with_backoff(
@@ -92,6 +129,7 @@ def retry_with_backoff(
 ):
     """
     Décorateur pour retry avec backoff exponentiel
+    (fonctions synchrones et coroutines)
     
     Args:
         max_attempts: Nombre maximum de tentatives
@@ -101,6 +139,49 @@ def retry_with_backoff(
         exceptions: Types d'exceptions à retry
     """
     def decorator(func: Callable) -> Callable:
+        # Calendrier des délais de backoff exponentiel, calculé une fois par fonction
+        delays = tuple(
+            min(base_delay * (exponential_base ** attempt), max_delay)
+            for attempt in range(max_attempts - 1)
+        )
+        
+        def compute_delay(attempt: int, error: Exception) -> float:
+            """Calcule le délai avant la prochaine tentative (ou lève si épuisé)"""
+            if attempt == max_attempts - 1:
+                # Dernière tentative, on lève l'exception
+                logger.error(
+                    f"Échec définitif après {max_attempts} tentatives: {error}"
+                )
+                raise error
+            
+            # Délai décalé aléatoirement (±20 %) pour que les appelants en échec
+            # simultané ne réessaient pas ensemble
+            delay = delays[attempt] * random.uniform(0.8, 1.2)
+            
+            logger.warning(
+                f"Tentative {attempt + 1}/{max_attempts} échouée: {error}. "
+                f"Retry dans {delay:.1f}s"
+            )
+            return delay
+        
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                last_exception = None
+                
+                for attempt in range(max_attempts):
+                    try:
+                        return await func(*args, **kwargs)
+                    except exceptions as e:
+                        last_exception = e
+                        # asyncio.sleep : ne bloque pas la boucle d'événements
+                        await asyncio.sleep(compute_delay(attempt, e))
+                
+                # Ne devrait jamais arriver, mais au cas où
+                raise last_exception
+            
+            return async_wrapper
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
@@ -110,26 +191,7 @@ def retry_with_backoff(
                     return func(*args, **kwargs)
                 except exceptions as e:
                     last_exception = e
-                    
-                    if attempt == max_attempts - 1:
-                        # Dernière tentative, on lève l'exception
-                        logger.error(
-                            f"Échec définitif après {max_attempts} tentatives: {e}"
-                        )
-                        raise e
-                    
-                    # Calcul du délai avec backoff exponentiel
-                    delay = min(
-                        base_delay * (exponential_base ** attempt),
-                        max_delay
-                    )
-                    
-                    logger.warning(
-                        f"Tentative {attempt + 1}/{max_attempts} échouée: {e}. "
-                        f"Retry dans {delay:.1f}s"
-                    )
-                    
-                    time.sleep(delay)
+                    time.sleep(compute_delay(attempt, e))
             
             # Ne devrait jamais arriver, mais au cas où
             raise last_exception
@@ -149,32 +211,37 @@ class RateLimiter:
         """
         self.max_calls = max_calls
         self.time_window = time_window
-        self.calls = []
+        # Seau à jetons : `max_calls` jetons au plus, rechargés à `rate` par seconde
+        self.rate = max_calls / time_window
+        self.tokens = float(max_calls)
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
     
     def __call__(self, func: Callable) -> Callable:
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            if not self._can_make_call():
-                raise Exception(
-                    f"Rate limit atteint: {self.max_calls} appels par {self.time_window}s"
-                )
-            
-            self._register_call()
+            # Vérification et enregistrement atomiques entre threads concurrents
+            with self._lock:
+                if not self._can_make_call():
+                    raise Exception(
+                        f"Rate limit atteint: {self.max_calls} appels par {self.time_window}s"
+                    )
+                self._register_call()
             return func(*args, **kwargs)
         return wrapper
     
     def _can_make_call(self) -> bool:
         """Vérifie si on peut faire un appel"""
-        now = time.time()
-        # Nettoie les anciens appels
-        self.calls = [call_time for call_time in self.calls 
-                     if now - call_time < self.time_window]
+        # Recharge proportionnelle au temps écoulé : O(1), sans historique d'appels
+        now = time.monotonic()
+        self.tokens = min(self.max_calls, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
         
-        return len(self.calls) < self.max_calls
+        return self.tokens >= 1.0
     
     def _register_call(self):
         """Enregistre un nouvel appel"""
-        self.calls.append(time.time())
+        self.tokens -= 1.0
 
 
 # Instances globales configurées pour TW3
@@ -1,9 +1,13 @@
 """Tests unitaires pour le backend TW3"""
 
+import asyncio
 import pytest
+import httpx
+import torch
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 import json
+import time
 from datetime import datetime
 
 # Import de l'application
@@ -11,12 +15,28 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../docker/images/backend'))
 
+import main
 from main import app, format_news_context, generate_answer
 
 
-@pytest.fixture
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Isole les tests : vide les caches partagés par le module main"""
+    if main.cache_manager:
+        main.cache_manager.news_cache.cache.clear()
+        main.cache_manager.news_cache._keys_by_query.clear()
+        main.cache_manager.news_cache._query_hits.clear()
+        main.cache_manager.model_cache.cache.clear()
+        main.cache_manager.answer_cache.cache.clear()
+
+
+@pytest.fixture(scope="session")
 def client():
-    """Client de test FastAPI"""
+    """Client de test FastAPI, partagé par toute la session
+    
+    Sans bloc `with`, le lifespan (chargement du modèle) n'est pas exécuté ;
+    l'état de l'application est injecté test par test via `monkeypatch`.
+    """
     return TestClient(app)
 
 
@@ -44,6 +64,16 @@ def mock_news_response():
     }
 
 
+@pytest.fixture
+def mock_http(monkeypatch):
+    """Installe un client httpx partagé dont les réponses sont simulées"""
+    def install(handler, attr="http", **client_kwargs):
+        transport = httpx.MockTransport(handler)
+        client = httpx.AsyncClient(transport=transport, **client_kwargs)
+        monkeypatch.setattr(app.state, attr, client, raising=False)
+    return install
+
+
 class TestHealthEndpoint:
     """Tests pour l'endpoint de santé"""
     
@@ -52,50 +82,305 @@ class TestHealthEndpoint:
         response = client.get("/")
         assert response.status_code == 200
         assert "Bienvenue" in response.json()["data"]
+    
+    @pytest.mark.asyncio
+    async def test_health_report_cached_and_shared(self, monkeypatch):
+        """Test que les appels concurrents partagent un seul calcul, ensuite resservi"""
+        import monitoring
+        
+        manager = monitoring.HealthCheckManager("key", lambda: None)
+        compute = AsyncMock(return_value={"status": "healthy"})
+        monkeypatch.setattr(manager, "_compute_report", compute)
+        
+        reports = await asyncio.gather(*(manager.get_full_health_report() for _ in range(3)))
+        assert reports == [{"status": "healthy"}] * 3
+        assert await manager.get_full_health_report() == {"status": "healthy"}
+        assert compute.await_count == 1
+        
+        monkeypatch.setattr(monitoring, "HEALTH_CACHE_TTL", 0)
+        await manager.get_full_health_report()
+        assert compute.await_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_health_probe_reuses_recent_check(self):
+        """Test qu'un état récent (sonde de fond ou usage réel) évite une nouvelle sonde"""
+        import monitoring
+        
+        manager = monitoring.HealthCheckManager("key", lambda: None)
+        now = datetime.now(monitoring.timezone.utc)
+        checker = Mock()
+        checker.check_health = AsyncMock(return_value=monitoring.ServiceHealth(
+            name="NewsAPI", status=monitoring.HealthStatus.HEALTHY, last_check=now
+        ))
+        
+        results = await asyncio.gather(*(manager._get_or_check('newsapi', checker, now) for _ in range(3)))
+        assert all(r is results[0] for r in results)
+        assert checker.check_health.await_count == 1
+        
+        later = now + monitoring.timedelta(seconds=manager._check_interval)
+        await manager._get_or_check('newsapi', checker, later)
+        assert checker.check_health.await_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_local_model_probe_does_not_generate(self, monkeypatch):
+        """Test que la sonde du modèle local ne lance aucune génération"""
+        import monitoring
+        
+        pipe = Mock()
+        monkeypatch.setattr(app.state, "pipe", pipe, raising=False)
+        monkeypatch.setattr(app.state, "gen_task", None, raising=False)
+        checker = monitoring.ModelHealthChecker(lambda: main._local_health_probe)
+        
+        health = await checker.check_health()
+        assert health.status == monitoring.HealthStatus.HEALTHY
+        pipe.assert_not_called()
+        pipe.model.generate.assert_not_called()
+        
+        monkeypatch.setattr(app.state, "pipe", None)
+        health = await checker.check_health()
+        assert health.status == monitoring.HealthStatus.UNHEALTHY
 
 
 class TestNewsAPIIntegration:
     """Tests pour l'intégration NewsAPI"""
     
-    @patch('main.requests.get')
-    def test_format_news_context_success(self, mock_get, mock_news_response):
+    @pytest.mark.asyncio
+    async def test_format_news_context_success(self, mock_http, mock_news_response):
         """Test de récupération d'actualités réussie"""
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = mock_news_response
-        mock_get.return_value.raise_for_status = Mock()
+        mock_http(lambda request: httpx.Response(200, json=mock_news_response))
         
-        result = format_news_context("test query")
+        result, n_articles = await format_news_context("test query")
         
         assert "Test Article 1" in result
         assert "Test Article 2" in result
         assert "Test Source 1" in result
         assert "https://test1.com" in result
+        assert n_articles == 2
     
-    @patch('main.requests.get')
-    def test_format_news_context_rate_limit(self, mock_get):
+    @pytest.mark.asyncio
+    async def test_format_news_context_encodes_params(self, mock_http, mock_news_response):
+        """Test de l'encodage des paramètres de requête (espaces, accents)"""
+        seen = {}
+        
+        def handler(request):
+            seen.update(request.url.params)
+            return httpx.Response(200, json=mock_news_response)
+        
+        mock_http(handler)
+        
+        await format_news_context("IA générative", from_date="2025-07-01")
+        
+        assert seen["q"] == "IA générative"
+        assert seen["from"] == "2025-07-01"
+        assert seen["language"] == "fr"
+    
+    @pytest.mark.asyncio
+    async def test_format_news_context_rate_limit(self, mock_http):
         """Test de gestion du rate limit NewsAPI"""
         mock_response = {
             "status": "error",
             "code": "rateLimited",
             "message": "Rate limit exceeded"
         }
-        mock_get.return_value.status_code = 429
-        mock_get.return_value.json.return_value = mock_response
-        mock_get.return_value.raise_for_status = Mock()
+        mock_http(lambda request: httpx.Response(429, json=mock_response))
         
-        result = format_news_context("test query")
+        result, n_articles = await format_news_context("test query")
         
         assert "[RATE LIMIT]" in result
+        assert n_articles == 0
     
-    @patch('main.requests.get')
-    def test_format_news_context_connection_error(self, mock_get):
+    @pytest.mark.asyncio
+    async def test_format_news_context_connection_error(self, mock_http, monkeypatch):
         """Test de gestion d'erreur de connexion"""
-        mock_get.side_effect = ConnectionError("Connection failed")
+        import resilience
+        
+        monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0)  # retries sans délai
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError("Connection failed")
+        
+        mock_http(handler)
         
-        result = format_news_context("test query")
+        result, _ = await format_news_context("test query")
         
         assert "[ERREUR]" in result
-        assert "Impossible de se connecter" in result
+        assert "indisponible" in result
+        assert len(calls) == 3
+    
+    @pytest.mark.asyncio
+    async def test_format_news_context_retries_transient_errors(self, mock_http, mock_news_response, monkeypatch):
+        """Test du retry des erreurs transitoires (réseau, 5xx) avant le circuit breaker"""
+        import resilience
+        
+        monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0)
+        responses = [
+            httpx.ConnectError("Connection reset"),
+            httpx.Response(503, text="Service Unavailable"),
+            httpx.Response(200, json=mock_news_response),
+        ]
+        
+        def handler(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        
+        mock_http(handler)
+        
+        result, n_articles = await format_news_context("transitoire")
+        
+        assert n_articles == 2
+        assert not responses
+    
+    @pytest.mark.asyncio
+    async def test_format_news_context_coalesces_concurrent_misses(self, mock_http, mock_news_response):
+        """Test que des requêtes simultanées identiques n'émettent qu'un appel NewsAPI"""
+        calls = []
+        
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.01)  # laisse les autres requêtes arriver pendant l'appel
+            return httpx.Response(200, json=mock_news_response)
+        
+        mock_http(handler)
+        
+        results = await asyncio.gather(*(format_news_context("test query") for _ in range(3)))
+        
+        assert len(calls) == 1
+        assert all(n_articles == 2 for _, n_articles in results)
+    
+    @pytest.mark.asyncio
+    async def test_news_invalidation_ignores_failed_probes(self, mock_http, monkeypatch):
+        """Test qu'une sonde en erreur (429) n'invalide pas le cache d'actualités"""
+        news_cache = main.cache_manager.news_cache
+        await news_cache.set_news("IA", "2025-07-01", "relevancy", 5, "articles")
+        await news_cache.get_news("IA", "2025-07-01", "relevancy", 5)
+        
+        def article(date):
+            return httpx.Response(200, json={"status": "ok", "articles": [{"publishedAt": date}]})
+        
+        responses = [
+            article("2025-07-15T10:00:00Z"),
+            httpx.Response(429, json={"status": "error", "code": "rateLimited"}),
+            article("2025-07-15T10:00:00Z"),
+            article("2025-07-15T12:00:00Z"),
+        ]
+        cached_after = []
+        done = asyncio.Event()
+        
+        async def handler(request):
+            cached_after.append(await news_cache.get_news("IA", "2025-07-01", "relevancy", 5))
+            if len(cached_after) == len(responses):
+                done.set()
+            return responses[len(cached_after) - 1]
+        
+        mock_http(handler)
+        monkeypatch.setattr(main, "NEWS_INVALIDATION_INTERVAL", 0)
+        task = asyncio.create_task(main._news_invalidation_loop())
+        await asyncio.wait_for(done.wait(), 5)
+        for _ in range(100):  # laisse la dernière sonde aboutir
+            if await news_cache.get_news("IA", "2025-07-01", "relevancy", 5) is None:
+                break
+            await asyncio.sleep(0)
+        task.cancel()
+        
+        # Présent avant chaque sonde jusqu'à la dernière, puis invalidé par la nouvelle date
+        assert cached_after == ["articles"] * 4
+        assert await news_cache.get_news("IA", "2025-07-01", "relevancy", 5) is None
+    
+    @pytest.mark.asyncio
+    async def test_news_cache_invalidate_query(self):
+        """Test de l'invalidation de toutes les fenêtres de dates d'une requête"""
+        news_cache = main.cache_manager.news_cache
+        await news_cache.set_news("IA", "2025-07-01", "relevancy", 5, "articles juillet")
+        await news_cache.set_news("IA", "2025-06-15", "relevancy", 5, "articles juin")
+        await news_cache.set_news("cinéma", "2025-07-01", "relevancy", 5, "articles cinéma")
+        await news_cache.get_news("ia", "2025-07-01", "relevancy", 5)
+        
+        assert news_cache.hot_queries(1) == ["ia"]
+        assert await news_cache.invalidate_query("IA") == 2
+        assert await news_cache.get_news("IA", "2025-07-01", "relevancy", 5) is None
+        assert await news_cache.get_news("IA", "2025-06-15", "relevancy", 5) is None
+        assert await news_cache.get_news("cinéma", "2025-07-01", "relevancy", 5) == "articles cinéma"
+    
+    @pytest.mark.asyncio
+    async def test_news_cache_promotes_l2_hits(self):
+        """Test que le L2 est attendu (sans bloquer la boucle) et promu dans le L1"""
+        from cache import NewsCache
+        
+        class FakeL2:
+            def __init__(self):
+                self.data = {}
+            
+            async def get(self, key):
+                return self.data.get(key)
+            
+            async def set(self, key, value, ttl=None):
+                self.data[key] = value
+            
+            async def delete(self, key):
+                self.data.pop(key, None)
+        
+        l2 = FakeL2()
+        writer, reader = NewsCache(l2=l2), NewsCache(l2=l2)
+        await writer.set_news("IA", "2025-07-01", "relevancy", 5, "articles")
+        
+        assert await reader.get_news("IA", "2025-07-01", "relevancy", 5) == "articles"
+        l2.data.clear()
+        assert await reader.get_news("IA", "2025-07-01", "relevancy", 5) == "articles"
+        assert await reader.invalidate_query("IA") == 1
+        assert await reader.get_news("IA", "2025-07-01", "relevancy", 5) is None
+    
+    @pytest.mark.asyncio
+    async def test_search_tools_errors_are_not_cached(self, monkeypatch, mock_news_response):
+        """Test que search_tools renvoie un contexte vide sur erreur, sans le mettre en cache"""
+        import search_tools
+        from cache import NewsCache
+        
+        mock_news_response["articles"][0]["source"] = None
+        responses = [
+            httpx.ConnectError("DNS"),
+            httpx.Response(429, json={"status": "error", "code": "rateLimited", "message": "Too many requests"}),
+            httpx.Response(200, json=mock_news_response),
+        ]
+        
+        def handler(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        
+        monkeypatch.setattr(search_tools, "CLIENT", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(search_tools, "NEWS_CACHE", NewsCache())
+        
+        assert await search_tools.format_news_context("erreurs") == ""
+        assert await search_tools.format_news_context("erreurs") == ""
+        context = await search_tools.format_news_context("erreurs")
+        assert "- Test Article 1 (, 2025-07-15)" in context
+        assert "Test Source 2" in context
+    
+    def test_in_memory_cache_evicts_least_recently_used(self):
+        """Test de l'éviction LRU : une lecture protège l'entrée de l'éviction"""
+        from cache import InMemoryCache
+        
+        cache = InMemoryCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        assert cache.get_stats()["evictions"] == 1
+        
+        # Taille tenue à jour à l'écrasement, à la suppression et à l'éviction
+        cache.set("a", "x" * 1000)
+        assert cache.get_stats()["bytes"] > 1000
+        cache.delete("a")
+        cache.delete("c")
+        assert cache.get_stats()["bytes"] == 0
 
 
 class TestAskEndpoint:
@@ -105,7 +390,7 @@ class TestAskEndpoint:
     @patch('main.generate_answer')
     def test_ask_with_news_context(self, mock_generate, mock_news, client):
         """Test de question avec contexte d'actualités"""
-        mock_news.return_value = "- Article test (Source, 2025-07-15) — Description\n  https://test.com"
+        mock_news.return_value = ("- Article test (Source, 2025-07-15) — Description\n  https://test.com", 1)
         mock_generate.return_value = "Réponse générée par le modèle"
         
         payload = {"question": "Que se passe-t-il en IA ?"}
@@ -116,12 +401,29 @@ class TestAskEndpoint:
         assert "conv_id" in data
         assert "answer" in data
         assert data["answer"] == "Réponse générée par le modèle"
+        # NewsAPI est interrogée avec les mots-clés, pas la question brute
+        assert mock_news.await_args.kwargs["query"] == "ia"
+    
+    def test_keywords_canonical_form(self):
+        """Test que des formulations équivalentes donnent la même requête NewsAPI"""
+        assert main._keywords("Quelles sont les dernières avancées en IA générative ?") == "avancées générative ia"
+        assert main._keywords("avancées IA générative récentes") == "avancées générative ia"
+        assert main._keywords("???") == "???"
+    
+    def test_needs_news_skips_code_and_math(self):
+        """Test de l'heuristique écartant NewsAPI pour le code et les calculs"""
+        assert main._needs_news("IA générative")
+        assert main._needs_news("Quelles sont les dernières avancées en IA générative ?")
+        assert not main._needs_news("2+2 ?")
+        assert not main._needs_news("Corrige ce code :\n```python\nprint(1)\n```")
+        assert not main._needs_news("def f(x):\n    return x")
+        assert not main._needs_news("Quelles sont les actualités ?")
     
     @patch('main.format_news_context')
     @patch('main.generate_answer')
     def test_ask_without_news_context(self, mock_generate, mock_news, client):
         """Test de question sans contexte d'actualités"""
-        mock_news.return_value = ""
+        mock_news.return_value = ("", 0)
         mock_generate.return_value = "Réponse basée sur connaissances internes"
         
         payload = {"question": "Question générale"}
@@ -132,6 +434,49 @@ class TestAskEndpoint:
         assert "conv_id" in data
         assert "answer" in data
     
+    @patch('main.format_news_context')
+    @patch('main.generate_answer')
+    def test_ask_answer_cache_skips_generation(self, mock_generate, mock_news, client):
+        """Test qu'une question identique, avec les mêmes actualités, ne relance pas le modèle"""
+        mock_news.return_value = ("- Article test (Source, 2025-07-15) — Description\n  https://test.com", 1)
+        mock_generate.return_value = "Réponse mise en cache"
+        
+        payload = {"question": "Que se passe-t-il en IA ?"}
+        first = client.post("/ask", json=payload)
+        second = client.post("/ask", json=payload)
+        
+        assert first.json()["answer"] == second.json()["answer"] == "Réponse mise en cache"
+        assert mock_generate.await_count == 1
+    
+    @patch('main.format_news_context')
+    @patch('main.generate_answer')
+    def test_ask_max_tokens_budget(self, mock_generate, mock_news, client):
+        """Test du budget de tokens par requête, borné par la validation"""
+        mock_news.return_value = ("", 0)
+        mock_generate.return_value = "Réponse courte"
+        
+        response = client.post("/ask", json={"question": "Test question", "max_tokens": 128})
+        
+        assert response.status_code == 200
+        assert mock_generate.await_args.kwargs["max_new_tokens"] == 128
+        assert client.post("/ask", json={"question": "Test question", "max_tokens": 4096}).status_code == 422
+    
+    @patch('main.generate_answer')
+    def test_ask_news_deadline_falls_back_without_news(self, mock_generate, client, monkeypatch):
+        """Test qu'une NewsAPI trop lente ne bloque pas la génération"""
+        async def slow_news(**kwargs):
+            await asyncio.sleep(1)
+            return ("- Article tardif", 1)
+        
+        monkeypatch.setattr(main, "format_news_context", slow_news)
+        monkeypatch.setattr(main, "NEWS_DEADLINE", 0.01)
+        mock_generate.return_value = "Réponse sans actualités"
+        
+        response = client.post("/ask", json={"question": "Test question"})
+        
+        assert response.json()["answer"] == "Réponse sans actualités"
+        assert mock_generate.await_args.args[0] == main._build_prompt("Test question")
+    
     def test_ask_invalid_question(self, client):
         """Test avec question trop courte"""
         payload = {"question": "Hi"}  # Moins de 3 caractères
@@ -142,7 +487,7 @@ class TestAskEndpoint:
     @patch('main.format_news_context')
     def test_ask_news_api_error_handling(self, mock_news, client):
         """Test de gestion d'erreur NewsAPI"""
-        mock_news.return_value = "[ERREUR] Impossible de se connecter à NewsAPI"
+        mock_news.return_value = ("[ERREUR] Impossible de se connecter à NewsAPI", 0)
         
         payload = {"question": "Question test"}
         response = client.post("/ask", json=payload)
@@ -152,35 +497,284 @@ class TestAskEndpoint:
         assert "Erreur lors de la récupération" in data["answer"]
 
 
+class TestAskStreamEndpoint:
+    """Tests pour l'endpoint /ask/stream (Server-Sent Events)"""
+    
+    @staticmethod
+    def _events(response):
+        return [line[len("data: "):] for line in response.text.splitlines() if line.startswith("data: ")]
+    
+    @staticmethod
+    async def _drain(stream):
+        return [text async for text in stream]
+    
+    @patch('main.format_news_context')
+    def test_ask_stream_yields_deltas(self, mock_news, client):
+        """Test de la diffusion des fragments puis du marqueur de fin"""
+        mock_news.return_value = ("", 0)
+        
+        async def fake_stream(prompt, *args, **kwargs):
+            for delta in ("Bon", "jour"):
+                yield delta
+        
+        with patch('main.stream_answer', fake_stream):
+            response = client.post("/ask/stream", json={"question": "Question test"})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self._events(response)
+        assert [json.loads(e)["delta"] for e in events[:-1]] == ["Bon", "jour"]
+        assert events[-1] == "[DONE]"
+    
+    @patch('main.format_news_context')
+    def test_ask_stream_news_api_error(self, mock_news, client):
+        """Test de la réponse de repli quand NewsAPI est en erreur"""
+        mock_news.return_value = ("[ERREUR] Impossible de se connecter à NewsAPI", 0)
+        
+        response = client.post("/ask/stream", json={"question": "Question test"})
+        
+        events = self._events(response)
+        assert "Erreur lors de la récupération" in json.loads(events[0])["delta"]
+        assert events[-1] == "[DONE]"
+    
+    @pytest.mark.asyncio
+    async def test_stream_local_generation_error_ends_stream(self, monkeypatch):
+        """Test qu'une erreur de `generate` termine le flux et remonte au consommateur"""
+        pipe = Mock()
+        pipe.model.generate.side_effect = RuntimeError("CUDA out of memory")
+        monkeypatch.setattr(main, "_input_ids", lambda pipe, prompt: torch.tensor([[1, 2]]))
+        monkeypatch.setattr(main, "_prefix_cache_kwargs", lambda ids: {})
+        monkeypatch.setattr(main, "_stop_token_kwargs", lambda tokenizer: {})
+        
+        with pytest.raises(RuntimeError, match="out of memory"):
+            await asyncio.wait_for(self._drain(main._stream_local(pipe, "prompt", 8, 0.0)), 5)
+    
+    @pytest.mark.asyncio
+    async def test_stream_local_stops_generation_when_abandoned(self, monkeypatch):
+        """Test qu'un flux abandonné (client déconnecté) interrompt `generate`"""
+        steps = []
+        
+        def fake_generate(input_ids, streamer, stopping_criteria, **kwargs):
+            while len(steps) < 5000 and not stopping_criteria(input_ids, None).all():
+                steps.append(1)
+                streamer.on_finalized_text("x")
+                time.sleep(0.001)
+            streamer.end()
+        
+        pipe = Mock()
+        pipe.model.generate.side_effect = fake_generate
+        monkeypatch.setattr(main, "_input_ids", lambda pipe, prompt: torch.tensor([[1, 2]]))
+        monkeypatch.setattr(main, "_prefix_cache_kwargs", lambda ids: {})
+        monkeypatch.setattr(main, "_stop_token_kwargs", lambda tokenizer: {})
+        
+        stream = main._stream_local(pipe, "prompt", 8, 0.0)
+        assert await stream.__anext__() == "x"
+        await asyncio.wait_for(stream.aclose(), 5)
+        
+        assert len(steps) < 5000
+
+
 class TestModelGeneration:
     """Tests pour la génération de réponses"""
     
-    @patch('main.get_pipe')
-    def test_generate_answer_string_response(self, mock_pipe):
-        """Test génération avec réponse string"""
-        mock_pipeline = Mock()
-        mock_pipeline.return_value = [{"generated_text": "Réponse directe"}]
-        mock_pipe.return_value = mock_pipeline
+    @pytest.mark.asyncio
+    async def test_generate_answer_local_decodes_new_tokens(self, monkeypatch):
+        """Test génération locale : model.generate direct, seuls les tokens générés décodés"""
+        pipe = Mock()
+        pipe.model.device = "cpu"
+        pipe.tokenizer.side_effect = lambda text, **kwargs: Mock(input_ids=[7] * len(text))
+        pipe.model.generate.side_effect = lambda input_ids, **kwargs: torch.cat(
+            [input_ids, torch.tensor([[1, 2, 3]])], dim=1
+        )
+        pipe.tokenizer.decode.return_value = " Réponse directe "
+        monkeypatch.setattr(app.state, "pipe", pipe, raising=False)
+        monkeypatch.setattr(app.state, "prompt_prefixes", ("<u>", "<a>", {}), raising=False)
         
-        result = generate_answer("Test prompt")
+        result = await generate_answer("Test prompt")
         
         assert result == "Réponse directe"
+        assert pipe.tokenizer.decode.call_args.args[0].tolist() == [1, 2, 3]
+        kwargs = pipe.model.generate.call_args.kwargs
+        assert kwargs["max_new_tokens"] == main.DEFAULT_MAX_NEW_TOKENS
+        assert kwargs["eos_token_id"] == pipe.tokenizer.eos_token_id
+        pipe.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_model_cache_only_for_greedy_generation(self, monkeypatch):
+        """Test que seules les générations déterministes (temperature 0) sont resservies"""
+        fake_generate = AsyncMock(return_value="Réponse")
+        monkeypatch.setattr(main, "_generate", fake_generate)
+        
+        for temperature in (0.7, 0.7, 0.0, 0.0):
+            assert await generate_answer("Test prompt", temperature=temperature) == "Réponse"
+        
+        assert [c.args[2] for c in fake_generate.await_args_list] == [0.7, 0.7, 0.0]
+    
+    @pytest.mark.asyncio
+    async def test_generation_loop_batches_queued_prompts(self, monkeypatch):
+        """Test de la boucle de génération : requêtes en attente décodées en un seul lot"""
+        pipe = Mock()
+        pipe.model.device = "cpu"
+        pipe.tokenizer.pad_token_id = 0
+        pipe.tokenizer.side_effect = lambda text, **kwargs: Mock(input_ids=[7] * len(text))
+        pipe.model.generate.side_effect = lambda input_ids, **kwargs: torch.cat(
+            [input_ids, torch.arange(input_ids.shape[0]).unsqueeze(1) + 1], dim=1
+        )
+        pipe.tokenizer.decode.side_effect = lambda ids, **kwargs: f"réponse {ids.tolist()[0]}"
+        monkeypatch.setattr(app.state, "pipe", pipe, raising=False)
+        monkeypatch.setattr(app.state, "prompt_prefixes", ("", "", {}), raising=False)
+        queue = asyncio.Queue()
+        monkeypatch.setattr(main, "_gen_queue", queue)
+        
+        results = asyncio.gather(main._generate("court", 64, 0.7), main._generate("plus long", 64, 0.7))
+        loop_task = asyncio.create_task(main._generation_loop(queue))
+        assert await results == ["réponse 1", "réponse 2"]
+        await queue.put(None)
+        await loop_task
+        
+        assert pipe.model.generate.call_count == 1
+        kwargs = pipe.model.generate.call_args.kwargs
+        assert kwargs["input_ids"].tolist() == [[0] * 4 + [7] * 5, [7] * 9]
+        assert kwargs["attention_mask"].tolist() == [[0] * 4 + [1] * 5, [1] * 9]
     
-    @patch('main.get_pipe')
-    def test_generate_answer_list_response(self, mock_pipe):
-        """Test génération avec réponse liste de messages"""
-        mock_pipeline = Mock()
-        mock_pipeline.return_value = [{
-            "generated_text": [
-                {"role": "user", "content": "Question"},
-                {"role": "assistant", "content": "Réponse assistant"}
-            ]
-        }]
-        mock_pipe.return_value = mock_pipeline
+    @pytest.mark.asyncio
+    async def test_generate_answer_remote_backend(self, mock_http, monkeypatch):
+        """Test génération déléguée au serveur vLLM (API OpenAI)"""
+        seen = {}
         
-        result = generate_answer("Test prompt")
+        def handler(request):
+            seen["path"] = request.url.path
+            seen["body"] = json.loads(request.content)
+            return httpx.Response(200, json={
+                "choices": [{"message": {"role": "assistant", "content": " Réponse vLLM "}}]
+            })
         
-        assert result == "Réponse assistant"
+        mock_http(handler, attr="llm_http", base_url=main.REMOTE_LLM_URL)
+        monkeypatch.setattr(main, "LLM_BACKEND", "remote")
+        
+        result = await generate_answer("Test prompt", max_new_tokens=64)
+        
+        assert result == "Réponse vLLM"
+        assert seen["path"] == "/v1/chat/completions"
+        assert seen["body"]["messages"] == [{"role": "user", "content": "Test prompt"}]
+        assert seen["body"]["max_tokens"] == 64
+    
+    @pytest.mark.asyncio
+    async def test_stream_answer_remote_backend(self, mock_http, monkeypatch):
+        """Test du relais des fragments SSE renvoyés par le serveur vLLM"""
+        def chunk(content):
+            return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]}) + "\n\n"
+        
+        def handler(request):
+            assert json.loads(request.content)["stream"] is True
+            body = chunk("Bon") + chunk("jour") + "data: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        
+        mock_http(handler, attr="llm_http", base_url=main.REMOTE_LLM_URL)
+        monkeypatch.setattr(main, "LLM_BACKEND", "remote")
+        
+        deltas = [delta async for delta in main.stream_answer("Test prompt")]
+        
+        assert deltas == ["Bon", "jour"]
+    
+    @pytest.mark.asyncio
+    async def test_stream_answer_local_holds_back_stop_sequence(self, monkeypatch):
+        """Test que la séquence d'arrêt émise par le décodage local n'est ni publiée ni mise en cache"""
+        async def fake_stream_local(pipe, prompt, max_new_tokens, temperature):
+            for text in ("Bonjour", "\n", "\nQues", "tion : suite", " encore"):
+                yield text
+        
+        monkeypatch.setattr(main, "LLM_BACKEND", "transformers")
+        monkeypatch.setattr(app.state, "pipe", Mock(), raising=False)
+        monkeypatch.setattr(main, "_stream_local", fake_stream_local)
+        
+        deltas = [delta async for delta in main.stream_answer("Test prompt", temperature=0.0)]
+        
+        assert deltas == ["Bonjour"]
+        cache_key = main.cache_manager.model_cache.make_key("Test prompt", main.DEFAULT_MAX_NEW_TOKENS, 0.0)
+        assert main.cache_manager.model_cache.get_response(cache_key) == "Bonjour"
+    
+    @pytest.mark.asyncio
+    async def test_generate_answer_vllm_backend(self, monkeypatch):
+        """Test génération avec le moteur vLLM asynchrone (ids du prompt, texte cumulé)"""
+        seen = {}
+        
+        async def fake_generate(prompt, params, request_id):
+            seen["prompt"], seen["params"] = prompt, params
+            for text in (" Réponse", " Réponse vLLM locale "):
+                yield Mock(outputs=[Mock(text=text)])
+        
+        llm = Mock()
+        llm.generate = fake_generate
+        tokenizer = Mock(side_effect=lambda text, **kwargs: Mock(input_ids=[len(text)]))
+        monkeypatch.setattr(app.state, "llm", llm, raising=False)
+        monkeypatch.setattr(app.state, "llm_tokenizer", tokenizer, raising=False)
+        monkeypatch.setattr(app.state, "prompt_prefixes", ("<u>", "<a>", {}), raising=False)
+        monkeypatch.setattr(main, "LLM_BACKEND", "vllm")
+        monkeypatch.setattr(main, "_sampling_params", Mock(return_value="params"))
+        
+        deltas = [delta async for delta in main.stream_answer("Test prompt", max_new_tokens=64, temperature=0.2)]
+        
+        assert deltas == [" Réponse", " vLLM locale "]
+        main._sampling_params.assert_called_once_with(0.2, 64)
+        # Prompt transmis en ids : « <u>Test prompt<a> » tokenisé d'un bloc
+        assert seen == {"prompt": {"prompt_token_ids": [17]}, "params": "params"}
+        assert await generate_answer("Autre prompt", max_new_tokens=64, temperature=0.2) == "Réponse vLLM locale"
+    
+    def test_prefix_cache_kwargs_copies_matching_cache(self, monkeypatch):
+        """Test de la reprise du cache KV du préfixe : copie, uniquement si le prompt le prolonge"""
+        cache = {"kv": [1, 2]}
+        monkeypatch.setattr(app.state, "prefix_caches", [([1, 2], cache)], raising=False)
+        
+        kwargs = main._prefix_cache_kwargs([1, 2, 3])
+        assert kwargs["past_key_values"] == cache
+        assert kwargs["past_key_values"] is not cache
+        assert main._prefix_cache_kwargs([1, 3, 4]) == {}
+        assert main._prefix_cache_kwargs([1, 2]) == {}
+    
+    def test_assisted_kwargs_single_prompt_only(self, monkeypatch):
+        """Test que le modèle brouillon n'est utilisé que pour un prompt seul"""
+        draft = Mock()
+        monkeypatch.setattr(app.state, "draft_model", None, raising=False)
+        assert main._assisted_kwargs(1) == {}
+        
+        monkeypatch.setattr(app.state, "draft_model", draft)
+        assert main._assisted_kwargs(1) == {
+            "assistant_model": draft, "num_assistant_tokens": main.NUM_ASSISTANT_TOKENS
+        }
+        assert main._assisted_kwargs(2) == {}
+    
+    def test_prompt_templates_share_static_prefix(self):
+        """Test que les parties variables restent après le préfixe d'instructions (cache de préfixes)"""
+        for template, instructions in (
+            (main._PROMPT_WITH_NEWS, main.INSTRUCTIONS_WITH_NEWS),
+            (main._PROMPT_NO_NEWS, main.INSTRUCTIONS_NO_NEWS),
+        ):
+            assert template[0].startswith(instructions)
+            assert instructions.endswith("\n\n")
+            assert "{" not in instructions
+        assert main._build_prompt("q", "n") == (
+            main.INSTRUCTIONS_WITH_NEWS + "Question : q\n\nArticles d’actualité à exploiter :\nn\nRéponse :"
+        )
+        assert main._build_prompt("q") == main.INSTRUCTIONS_NO_NEWS + "Question : q\n\nRéponse :"
+    
+    def test_encode_prompt_reuses_prefix(self):
+        """Test que le préfixe pré-tokenisé donne les mêmes ids qu'un encodage complet"""
+        tokenizer = Mock()
+        tokenizer.apply_chat_template.side_effect = (
+            lambda messages, **kwargs: f"<|user|>{messages[0]['content']}<|assistant|>"
+        )
+        tokenizer.side_effect = lambda text, **kwargs: Mock(input_ids=[ord(c) for c in text])
+        prefixes = main.build_prompt_prefixes(tokenizer)
+        
+        prompt = main.INSTRUCTIONS_WITH_NEWS + "Question : test\n\nRéponse :"
+        expected = [ord(c) for c in f"<|user|>{prompt}<|assistant|>"]
+        
+        assert main._encode_prompt(tokenizer, prefixes, prompt) == expected
+        assert main._encode_prompt(tokenizer, prefixes, "Prompt libre") == [
+            ord(c) for c in "<|user|>Prompt libre<|assistant|>"
+        ]
+        assert tokenizer.apply_chat_template.call_count == 1
 
 
 class TestConversationLogging:
@@ -191,15 +785,79 @@ class TestConversationLogging:
     @patch('main.generate_answer')
     def test_conversation_logging(self, mock_generate, mock_news, mock_log, client):
         """Test du logging des conversations"""
-        mock_news.return_value = "Contexte news"
+        mock_news.return_value = ("Contexte news", 1)
         mock_generate.return_value = "Réponse"
         
         payload = {"question": "Test question"}
         response = client.post("/ask", json=payload)
         
         assert response.status_code == 200
-        # Vérifier que _append_log a été appelé pour user, news, prompt et bot
-        assert mock_log.call_count >= 3
+        # Une seule écriture par requête regroupant user, news, prompt et bot
+        assert mock_log.await_count == 1
+        entries = mock_log.await_args.args[3]
+        assert [role for role, _ in entries] == ["user", "news", "prompt", "bot"]
+        assert entries[2][1] == main._build_prompt("Test question", "Contexte news")
+    
+    def test_request_timestamps_format(self):
+        """Test des horodatages de requête (nom de fichier, entrées, date NewsAPI)"""
+        assert main._request_timestamps(1752573600) == (
+            "2025-07-15T100000", "2025-07-15T10:00:00Z", "2025-06-15"
+        )
+    
+    @pytest.mark.asyncio
+    async def test_append_log_writes_header_once(self, tmp_path, monkeypatch):
+        """Test de l'en-tête écrit une seule fois, sans stat() du fichier"""
+        monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+        
+        ts = "2025-07-15T10:00:00Z"
+        with patch('main.Path.exists') as mock_exists:
+            await main._append_log("abc", "20250715-100000", ts, [("user", "Question")])
+            await main._append_log("abc", "20250715-100000", ts, [("bot", "Réponse")])
+            mock_exists.assert_not_called()
+        
+        content = (tmp_path / "conv-abc_20250715-100000.txt").read_text(encoding="utf-8")
+        assert content.count("# Conversation abc") == 1
+        assert "[2025-07-15T10:00:00Z] USER: Question" in content
+        assert "BOT: Réponse" in content
+    
+    @pytest.mark.asyncio
+    async def test_append_log_goes_through_background_writer(self, tmp_path, monkeypatch):
+        """Test de l'écrivain de fond : un seul open par conversation, file vidée à l'arrêt"""
+        monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+        queue = asyncio.Queue()
+        monkeypatch.setattr(main, "_log_queue", queue)
+        
+        real_open = main.aiofiles.open
+        with patch('main.aiofiles.open', side_effect=real_open) as mock_open:
+            writer = asyncio.create_task(main._log_writer(queue))
+            ts = "2025-07-15T10:00:00Z"
+            for text in ("Question", "Relance", "Encore"):
+                await main._append_log("abc", "20250715-100000", ts, [("user", text)])
+            await queue.put(None)
+            await writer
+        
+        assert mock_open.call_count == 1
+        content = (tmp_path / "conv-abc_20250715-100000.txt").read_text(encoding="utf-8")
+        assert content.count("# Conversation abc") == 1
+        assert content.index("Question") < content.index("Relance") < content.index("Encore")
+    
+    @pytest.mark.asyncio
+    async def test_log_writer_skips_header_for_existing_file(self, tmp_path, monkeypatch):
+        """Test que l'écrivain de fond n'ajoute pas d'en-tête à un fichier déjà commencé"""
+        monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+        file = tmp_path / "conv-abc_20250715-100000.txt"
+        file.write_text("# Conversation abc – démarrée le 20250715-100000\n\n", encoding="utf-8")
+        queue = asyncio.Queue()
+        monkeypatch.setattr(main, "_log_queue", queue)
+        
+        writer = asyncio.create_task(main._log_writer(queue))
+        await main._append_log("abc", "20250715-100000", "2025-07-15T10:00:00Z", [("user", "Relance")])
+        await queue.put(None)
+        await writer
+        
+        content = file.read_text(encoding="utf-8")
+        assert content.count("# Conversation abc") == 1
+        assert content.endswith("USER: Relance\n")
 
 
 if __name__ == "__main__":